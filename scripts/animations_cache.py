@@ -0,0 +1,94 @@
+"""This module stores the scanned animations metadata in a cache file."""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import asdict
+
+from json_files import write_json
+from parse_index import IndexMetadata
+from scan_animations import AnimationInventory, FileStats
+
+
+class AnimationsCache:
+    """On-disk cache of animation inventories and index metadata.
+
+    Each entry is stored together with the modification time and size of
+    every file and folder of the animation, so it can be validated with a
+    single stat pass and rescanned only when something changed.
+    """
+
+    version = 2
+
+    def __init__(self, path: str) -> None:
+        """Initialize the cache and load its content from path, if any."""
+        self._path = path
+        self._entries: dict[str, dict] = {}
+        self._dirty = False
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(content, dict) and content.get("version") == self.version:
+            self._entries = content.get("animations", {})
+
+    @staticmethod
+    def _is_fresh(stats: dict[str, list[int]]) -> bool:
+        """Check that every recorded path still has the same mtime and size."""
+        for path, (mtime_ns, size) in stats.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if stat.st_mtime_ns != mtime_ns or stat.st_size != size:
+                return False
+
+        return True
+
+    def get(
+        self, folder: str
+    ) -> tuple[AnimationInventory, IndexMetadata | None] | None:
+        """Get the cached inventory and metadata of a folder, if still valid."""
+        entry = self._entries.get(folder)
+        if entry is None or not self._is_fresh(entry["stats"]):
+            return None
+
+        inventory = AnimationInventory(**entry["inventory"])
+        metadata = entry["metadata"]
+        if metadata is not None:
+            metadata = IndexMetadata(**metadata)
+
+        return inventory, metadata
+
+    def put(
+        self,
+        folder: str,
+        stats: FileStats,
+        inventory: AnimationInventory,
+        metadata: IndexMetadata | None,
+    ) -> None:
+        """Store the inventory and metadata of a folder."""
+        self._entries[folder] = {
+            "stats": stats,
+            "inventory": asdict(inventory),
+            "metadata": asdict(metadata) if metadata is not None else None,
+        }
+        self._dirty = True
+
+    def prune(self, folders: list[str]) -> None:
+        """Drop the entries of the folders that no longer exist."""
+        for folder in set(self._entries) - set(folders):
+            del self._entries[folder]
+            self._dirty = True
+
+    def save(self) -> None:
+        """Write the cache to disk, if anything changed."""
+        if not self._dirty:
+            return
+
+        write_json(self._path, {"version": self.version, "animations": self._entries})
+        self._dirty = False
@@ -0,0 +1,296 @@
+"""This script benchmarks the loader, checker and builder on synthetic animations.
+
+For each requested number of animations, a synthetic animations folder is
+generated from the template, with the given numbers of js files and fonts
+and the given preview size. Every stage of checking and building the
+website is then timed in a fresh process. The peak memory of that process
+and of its workers is reported once per scale: it is a high-water mark over
+the whole scale, generation included, not the memory of each stage.
+
+The build stages time the steps of WebsiteBuilder without precompression.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+from benchmark_results import Metrics, add_arguments, save_and_compare
+from build_website import WebsiteBuilder
+from check_animations import check_animations
+from load_animations import AnimationsLoader
+from PIL import Image, ImageDraw
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE = os.path.join(REPOSITORY, "template")
+HOMEPAGE = os.path.join(REPOSITORY, "homepage")
+
+# Stage slowdowns smaller than this are too noisy to be reported, in seconds
+MIN_DURATION = 0.05
+
+
+def generate_animation(
+    path: str,
+    name: str,
+    js_files: int,
+    fonts: int,
+    font_size: int,
+    preview: Image.Image,
+    rng: random.Random,
+) -> None:
+    """Generate a valid animation folder from the template."""
+    shutil.copytree(TEMPLATE, path)
+    title = name.upper().replace("-", " ")
+    index_path = os.path.join(path, "index.html")
+    with open(index_path, encoding="utf-8") as f:
+        index = f.read()
+    with open(index_path, "w", encoding="utf-8") as f:
+        f.write(index.replace("TEMPLATE", title))
+
+    families = []
+    font_faces = []
+    os.makedirs(os.path.join(path, "css", "fonts"), exist_ok=True)
+    for i in range(fonts):
+        family = f"Synthetic{i}"
+        with open(os.path.join(path, "css", "fonts", f"{family}.ttf"), "wb") as f:
+            f.write(rng.randbytes(font_size))
+        families.append(family)
+        font_faces.append(
+            f"@font-face {{\n  font-family: {family};\n"
+            f"  src: url(fonts/{family}.ttf);\n}}\n"
+        )
+    css_path = os.path.join(path, "css", "style.css")
+    with open(css_path, encoding="utf-8") as f:
+        css = f.read()
+    with open(css_path, "w", encoding="utf-8") as f:
+        f.write("".join(font_faces) + css)
+
+    for i in range(js_files):
+        with open(os.path.join(path, "js", f"module-{i}.js"), "w") as f:
+            f.write(f"// {name} module {i}\n")
+            for family in families:
+                f.write(f'const font_{family} = "16px {family}";\n')
+            for _ in range(rng.randint(20, 200)):
+                f.write(f"const value_{rng.getrandbits(32):x} = {rng.random()};\n")
+
+    # Every preview is different, so that none of them is cached or shared
+    image = preview.copy()
+    ImageDraw.Draw(image).rectangle(
+        (0, 0, image.width // 8, image.height // 8),
+        fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+    )
+    image.save(os.path.join(path, "preview.png"))
+
+
+def generate_animations(
+    path: str,
+    count: int,
+    js_files: int,
+    fonts: int,
+    font_size: int,
+    preview_size: int,
+    seed: int,
+) -> None:
+    """Generate a synthetic animations folder."""
+    rng = random.Random(seed)
+    preview = Image.effect_noise((preview_size, preview_size), 64).convert("RGB")
+    os.makedirs(path)
+    for i in range(count):
+        name = f"synthetic-{i:05d}"
+        generate_animation(
+            os.path.join(path, name), name, js_files, fonts, font_size, preview, rng
+        )
+
+
+def peak_rss() -> float:
+    """Get the peak resident memory of the process and its children, in MB.
+
+    This is the high-water mark of the whole run of the process so far.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def run_scale(count: int, options: dict) -> dict:
+    """Generate count animations, then check and build them stage by stage."""
+    warnings.filterwarnings(action="ignore", module="load_animations")
+    warnings.filterwarnings(action="ignore", module="build_website")
+    stages = {}
+
+    def add_stage(stage: str, duration: float) -> None:
+        stages[stage] = duration
+
+    with tempfile.TemporaryDirectory(prefix="build-benchmark-") as workspace:
+        started = time.perf_counter()
+        generate_animations(
+            os.path.join(workspace, AnimationsLoader.animations_folder),
+            count,
+            options["js_files"],
+            options["fonts"],
+            options["font_size"] * 1024,
+            options["preview_size"],
+            options["seed"],
+        )
+        shutil.copytree(HOMEPAGE, os.path.join(workspace, "homepage"))
+        generation = time.perf_counter() - started
+
+        # The loader and the builder work on the current directory
+        os.chdir(workspace)
+
+        started = time.perf_counter()
+        animations = list(AnimationsLoader.load_animations())
+        add_stage("scan", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for animation in animations:
+            _ = animation.metadata
+        add_stage("metadata", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for animation in animations:
+            animation.validate_css_fonts()
+            animation.validate_js_fonts()
+        add_stage("fonts", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        results = check_animations(animations, options["jobs"])
+        add_stage("check", time.perf_counter() - started)
+
+        builder = WebsiteBuilder(
+            destination="dist",
+            randomize=True,
+            seed=options["seed"],
+            use_cache=False,
+            jobs=options["jobs"],
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            # The animations are loaded outside of the timed stages
+            _ = builder._animations
+
+            started = time.perf_counter()
+            builder.build_structure()
+            add_stage("structure", time.perf_counter() - started)
+
+            instrumentation.reset()
+            builder.build_animations()
+            for stage in ("hash", "copy", "transcode"):
+                add_stage(stage, instrumentation.total(stage))
+
+            started = time.perf_counter()
+            builder.build_index()
+            add_stage("index", time.perf_counter() - started)
+
+    return {
+        "animations": count,
+        "generation": generation,
+        "issues": sum(len(result.issues) for result in results),
+        "stages": stages,
+        "peak_rss": peak_rss(),
+    }
+
+
+def flatten(results: list[dict]) -> Metrics:
+    """Get the stage durations and peak memory of each scale, for a baseline."""
+    metrics = {}
+    for result in results:
+        scale = f"{result['animations']} animations"
+        for stage, duration in result["stages"].items():
+            metrics[(f"{scale}, {stage}", "duration")] = duration
+        metrics[(scale, "peak_rss")] = result["peak_rss"]
+    return metrics
+
+
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the checks and the build on synthetic animations.",
+    )
+    parser.add_argument(
+        "--animations",
+        type=int,
+        nargs="+",
+        default=[100, 1000],
+        help="Numbers of synthetic animations to benchmark",
+    )
+    parser.add_argument(
+        "--js-files",
+        type=int,
+        default=3,
+        help="Number of extra js files of each animation",
+    )
+    parser.add_argument(
+        "--fonts",
+        type=int,
+        default=1,
+        help="Number of fonts of each animation",
+    )
+    parser.add_argument(
+        "--font-size",
+        type=int,
+        default=64,
+        help="Size of each font file, in kB",
+    )
+    parser.add_argument(
+        "--preview-size",
+        type=int,
+        default=1000,
+        help="Width and height of the preview images, in pixels",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to check and transcode",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic animations",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    options = {
+        "js_files": args.js_files,
+        "fonts": args.fonts,
+        "font_size": args.font_size,
+        "preview_size": args.preview_size,
+        "jobs": args.jobs,
+        "seed": args.seed,
+    }
+
+    # Each scale runs in a fresh process, so that its peak memory is its own
+    results = []
+    for count in args.animations:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_scale, count, options).result()
+        results.append(result)
+
+        print(
+            f"{count} animations (generated in {result['generation']:.1f}s, "
+            f"{result['issues']} issues)"
+        )
+        for stage, duration in result["stages"].items():
+            print(f"  {stage:<10}{duration:>9.3f}s")
+        print(f"  {'peak':<10}{result['peak_rss']:>9.1f} MB")
+
+    regressions = save_and_compare(args, results, flatten, {"duration": MIN_DURATION})
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""This script benchmarks the website publisher against a local SSH server.
+
+The server is started in process over a temporary folder. It serves SFTP
+and runs the exec commands of the publisher with a local shell, delaying
+every request by the given latency and the transferred data by the given
+bandwidth. Cold (empty server), warm (nothing changed) and small-delta
+deploys are then timed, along with their round trips and transferred bytes.
+After each deploy, the server tree is checked against the source.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+
+import asyncssh
+from benchmark_results import Metrics, add_arguments, save_and_compare
+from build_manifest import hash_file
+from publish_website import WebsitePublisher
+
+KEY_PASSPHRASE = "benchmark"
+DESTINATION = "site"
+
+# SFTP requests delayed by the simulated link
+SFTP_REQUESTS = [
+    "open",
+    "close",
+    "read",
+    "write",
+    "stat",
+    "lstat",
+    "fstat",
+    "setstat",
+    "fsetstat",
+    "mkdir",
+    "rmdir",
+    "remove",
+    "rename",
+    "posix_rename",
+    "realpath",
+    "readlink",
+    "symlink",
+]
+
+
+@dataclass
+class LinkStats:
+    """Traffic through the simulated link during a deploy."""
+
+    round_trips: int = 0
+    execs: int = 0
+    bytes_up: int = 0
+    bytes_down: int = 0
+
+
+class SimulatedLink:
+    """Network link between the publisher and the server, with its latency."""
+
+    def __init__(self, latency: float, bandwidth: float | None) -> None:
+        """Initialize the link, with latency in seconds and bandwidth in bytes/s."""
+        self._latency = latency
+        self._bandwidth = bandwidth
+        self._up = asyncio.Lock()
+        self._down = asyncio.Lock()
+        self.stats = LinkStats()
+
+    async def round_trip(self) -> None:
+        """Wait for a request to reach the server and its reply to come back."""
+        self.stats.round_trips += 1
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+    async def transfer(self, size: int, upload: bool) -> None:
+        """Wait for data to go through the link, one transfer at a time."""
+        if upload:
+            self.stats.bytes_up += size
+        else:
+            self.stats.bytes_down += size
+        if self._bandwidth:
+            async with self._up if upload else self._down:
+                await asyncio.sleep(size / self._bandwidth)
+
+
+class BenchmarkSFTPServer(asyncssh.SFTPServer):
+    """SFTP server chrooted in the server folder, behind the simulated link."""
+
+    def __init__(
+        self, chan: asyncssh.SSHServerChannel, root: str, link: SimulatedLink
+    ) -> None:
+        """Initialize the SFTP server."""
+        super().__init__(chan, chroot=root.encode())
+        self._link = link
+
+
+def _delayed(name: str) -> Callable[..., Awaitable]:
+    """Wrap an SFTP request handler so that it goes through the simulated link."""
+    handler = getattr(asyncssh.SFTPServer, name)
+
+    @functools.wraps(handler)
+    async def wrapper(self: BenchmarkSFTPServer, *args):
+        await self._link.round_trip()
+        if name == "write":
+            await self._link.transfer(len(args[2]), upload=True)
+        result = handler(self, *args)
+        if inspect.isawaitable(result):
+            result = await result
+        if name == "read":
+            await self._link.transfer(len(result), upload=False)
+        return result
+
+    return wrapper
+
+
+for _name in SFTP_REQUESTS:
+    setattr(BenchmarkSFTPServer, _name, _delayed(_name))
+
+
+class BenchmarkSSHServer(asyncssh.SSHServer):
+    """SSH server accepting any public key."""
+
+    def begin_auth(self, username: str) -> bool:
+        """Require authentication."""
+        return True
+
+    def public_key_auth_supported(self) -> bool:
+        """Accept public key authentication."""
+        return True
+
+    def validate_public_key(self, username: str, key: asyncssh.SSHKey) -> bool:
+        """Accept any key."""
+        return True
+
+
+async def run_command(
+    process: asyncssh.SSHServerProcess, root: str, link: SimulatedLink
+) -> None:
+    """Run an exec request with a local shell inside the server folder."""
+    link.stats.execs += 1
+    await link.round_trip()
+    shell = await asyncio.create_subprocess_shell(
+        process.command,
+        cwd=root,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def pump_input() -> None:
+        try:
+            while data := await process.stdin.read(65536):
+                await link.transfer(len(data), upload=True)
+                shell.stdin.write(data)
+                await shell.stdin.drain()
+        except (asyncssh.Error, ConnectionError):
+            pass
+        shell.stdin.close()
+
+    async def pump_output(
+        source: asyncio.StreamReader, target: asyncssh.SSHWriter
+    ) -> None:
+        while data := await source.read(65536):
+            await link.transfer(len(data), upload=False)
+            target.write(data)
+
+    # The input is not always closed by the client, stop reading it on exit
+    input_task = asyncio.ensure_future(pump_input())
+    await asyncio.gather(
+        pump_output(shell.stdout, process.stdout),
+        pump_output(shell.stderr, process.stderr),
+    )
+    status = await shell.wait()
+    input_task.cancel()
+    process.exit(status)
+
+
+async def start_server(root: str, link: SimulatedLink) -> asyncssh.SSHAcceptor:
+    """Start the benchmark SSH server on a free local port."""
+    return await asyncssh.listen(
+        "127.0.0.1",
+        0,
+        server_factory=BenchmarkSSHServer,
+        server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+        sftp_factory=functools.partial(BenchmarkSFTPServer, root=root, link=link),
+        process_factory=functools.partial(run_command, root=root, link=link),
+        encoding=None,
+    )
+
+
+def generate_tree(path: str, files: int, seed: int) -> None:
+    """Generate a synthetic website of small scripts and a few large assets."""
+    rng = random.Random(seed)
+    for i in range(files):
+        folder = os.path.join(path, f"animation-{i // 10:03d}")
+        os.makedirs(folder, exist_ok=True)
+        if i % 50 == 49:
+            name, size = f"asset-{i}.bin", rng.randint(256, 1024) * 1024
+        else:
+            name, size = f"file-{i}.js", rng.randint(1, 32) * 1024
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(rng.randbytes(size))
+
+
+def change_tree(path: str, seed: int) -> None:
+    """Make a small change to a website: edit, add and remove a few files."""
+    rng = random.Random(seed)
+    files = sorted(
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(path)
+        for name in names
+        if not name.startswith(".")
+    )
+    edited = rng.sample(files, min(3, len(files)))
+    for file in edited:
+        with open(file, "ab") as f:
+            f.write(b"\n// edited\n")
+    removed = next((file for file in files if file not in edited), None)
+    if removed is not None:
+        os.remove(removed)
+    new_folder = os.path.join(path, "new-animation")
+    os.makedirs(new_folder, exist_ok=True)
+    with open(os.path.join(new_folder, "index.html"), "wb") as f:
+        f.write(rng.randbytes(4096))
+
+    # A few bytes changed in the middle of the largest file
+    largest = max(
+        (file for file in files if os.path.exists(file)), key=os.path.getsize
+    )
+    with open(largest, "r+b") as f:
+        f.seek(os.path.getsize(largest) // 2)
+        f.write(b"edited")
+
+
+def tree_hashes(path: str) -> dict[str, str]:
+    """Get the hash of every published file of a tree, keyed by relative path.
+
+    Hidden files and folders are skipped, like the bookkeeping files of the
+    publisher, except the server configuration which is published.
+    """
+    hashes = {}
+    for folder, dirnames, filenames in os.walk(path):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for name in filenames:
+            if name.startswith(".") and name != ".htaccess":
+                continue
+            file = os.path.join(folder, name)
+            hashes[os.path.relpath(file, path)] = hash_file(file)
+    return hashes
+
+
+def tree_mismatches(source: str, published: str) -> list[str]:
+    """Compare the published tree with the source, returning the differences."""
+    expected = tree_hashes(source)
+    actual = tree_hashes(published) if os.path.isdir(published) else {}
+    mismatches = []
+    for rel_path in sorted(expected.keys() | actual.keys()):
+        if rel_path not in actual:
+            mismatches.append(f"{rel_path}: missing on the server")
+        elif rel_path not in expected:
+            mismatches.append(f"{rel_path}: removed from the source")
+        elif actual[rel_path] != expected[rel_path]:
+            mismatches.append(f"{rel_path}: content differs")
+    return mismatches
+
+
+async def deploy(
+    scenario: str,
+    source: str,
+    root: str,
+    port: int,
+    key: str,
+    link: SimulatedLink,
+    options: dict,
+) -> dict:
+    """Publish the source folder to the server, measure the deploy and check it."""
+    publisher = WebsitePublisher(source, DESTINATION, **options)
+    await publisher.connect("127.0.0.1", "benchmark", key, KEY_PASSPHRASE, port)
+
+    link.stats = LinkStats()
+    started = time.perf_counter()
+    await publisher.publish()
+    await publisher.cleanup_remote()
+    await publisher.write_deploy_manifest()
+    wall_time = time.perf_counter() - started
+    await publisher.disconnect()
+
+    return {
+        "scenario": scenario,
+        "wall_time": wall_time,
+        **asdict(link.stats),
+        "failures": publisher.metrics.failures,
+        "mismatches": tree_mismatches(source, os.path.join(root, DESTINATION)),
+    }
+
+
+async def run_benchmark(args: argparse.Namespace) -> list[dict]:
+    """Run the cold, warm and small-delta deploys."""
+    link = SimulatedLink(
+        args.latency / 1000,
+        args.bandwidth * 1e6 / 8 if args.bandwidth else None,
+    )
+    key = asyncssh.generate_private_key("ssh-ed25519")
+    key_data = key.export_private_key(passphrase=KEY_PASSPHRASE).decode()
+    options = {
+        "workers": args.workers,
+        "sessions": args.sessions,
+        "transport": args.transport,
+        "delta_threshold": args.delta_threshold or None,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="publish-benchmark-") as tmp:
+        # The publisher writes its hash cache in the source, work on a copy
+        source = os.path.join(tmp, "source")
+        root = os.path.join(tmp, "server")
+        os.makedirs(root)
+        if args.source is not None:
+            shutil.copytree(args.source, source)
+        else:
+            generate_tree(source, args.files, args.seed)
+
+        server = await start_server(root, link)
+        port = server.sockets[0].getsockname()[1]
+        server_args = (root, port, key_data, link, options)
+        try:
+            results = [await deploy("cold", source, *server_args)]
+            results.append(await deploy("warm", source, *server_args))
+            change_tree(source, args.seed)
+            results.append(await deploy("delta", source, *server_args))
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    return results
+
+
+METRICS = ["wall_time", "round_trips", "execs", "bytes_up", "bytes_down"]
+
+
+def flatten(results: list[dict]) -> Metrics:
+    """Get the metrics of each scenario, to compare them with a baseline."""
+    return {
+        (result["scenario"], metric): result[metric]
+        for result in results
+        for metric in METRICS
+    }
+
+
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the website publication against a local server.",
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        default=None,
+        help="Website to publish (e.g. dist), a synthetic one by default",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=500,
+        help="Number of files of the synthetic website",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic website and of its changes",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=20,
+        help="Round-trip time of each request, in milliseconds",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=float,
+        default=50,
+        help="Bandwidth of the link in Mbit/s (0 for unlimited)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of concurrent workers of the publisher",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=4,
+        help="Number of SFTP sessions of the publisher",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=["sftp", "tar"],
+        default="sftp",
+        help="Transport of the publisher",
+    )
+    parser.add_argument(
+        "--delta-threshold",
+        type=int,
+        default=256 * 1024,
+        help="Delta threshold of the publisher, in bytes (0 to disable)",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run_benchmark(args))
+
+    print(
+        f"{'scenario':<10}{'time (s)':>10}{'round trips':>13}{'execs':>7}"
+        f"{'sent (kB)':>12}{'received (kB)':>15}{'failures':>10}{'mismatches':>12}"
+    )
+    for result in results:
+        print(
+            f"{result['scenario']:<10}{result['wall_time']:>10.2f}"
+            f"{result['round_trips']:>13}{result['execs']:>7}"
+            f"{result['bytes_up'] / 1024:>12.1f}"
+            f"{result['bytes_down'] / 1024:>15.1f}{result['failures']:>10}"
+            f"{len(result['mismatches']):>12}"
+        )
+    for result in results:
+        for mismatch in result["mismatches"]:
+            print(f"Mismatch after the {result['scenario']} deploy: {mismatch}")
+
+    # An increase of at most one second, round trip, exec or byte is noise
+    regressions = save_and_compare(
+        args, results, flatten, {metric: 1 for metric in METRICS}
+    )
+    if regressions:
+        sys.exit(1)
+
+    if any(result["failures"] or result["mismatches"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
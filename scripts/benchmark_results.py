@@ -0,0 +1,83 @@
+"""This module saves benchmark results and compares them with a baseline.
+
+Each benchmark flattens its results into metrics keyed by a group (e.g. a
+scenario) and a metric name, so that a run and its baseline are compared
+metric by metric.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from collections.abc import Callable
+
+Metrics = dict[tuple[str, str], float]
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the --output, --baseline and --threshold options to a benchmark."""
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Path of a JSON file to write the results to",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="JSON results of a previous run to compare with",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative increase over the baseline reported as a regression",
+    )
+
+
+def find_regressions(
+    metrics: Metrics,
+    baseline: Metrics,
+    threshold: float,
+    min_increase: dict[str, float] | None = None,
+) -> list[str]:
+    """Compare metrics with their baseline, returning the regressions.
+
+    A metric regresses when it grows by more than threshold, relatively, and
+    by more than the min_increase of its name, which ignores the noise of
+    small values.
+    """
+    min_increase = min_increase or {}
+    regressions = []
+    for (group, name), value in metrics.items():
+        old = baseline.get((group, name))
+        if old is None:
+            continue
+        if value > old * (1 + threshold) and value - old > min_increase.get(name, 0):
+            regressions.append(f"{group} {name}: {value:.6g} > {old:.6g}")
+    return regressions
+
+
+def save_and_compare(
+    args: argparse.Namespace,
+    results: list[dict],
+    flatten: Callable[[list[dict]], Metrics],
+    min_increase: dict[str, float] | None = None,
+) -> list[str]:
+    """Write the results and print their regressions over the baseline, if asked."""
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is None:
+        return []
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = flatten(json.load(f))
+    regressions = find_regressions(
+        flatten(results), baseline, args.threshold, min_increase
+    )
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return regressions
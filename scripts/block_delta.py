@@ -0,0 +1,197 @@
+"""This module computes rsync-style block deltas between two versions of a file.
+
+The remote copy of a file is split into blocks, whose weak rolling checksum
+and strong hash are computed on the server by REMOTE_HELPER. The local file
+is then scanned for those blocks, and only the data not found in the remote
+copy is sent, along with instructions to copy the other blocks.
+
+Delta instructions, read by REMOTE_HELPER from its stdin:
+
+- ``C`` followed by a block index (8 bytes) and a count (4 bytes): copy a run
+  of consecutive blocks of the remote copy,
+- ``L`` followed by a length (4 bytes) and the data: literal data,
+- ``E`` followed by the SHA256 digest of the new file: end of the delta.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import math
+import mmap
+import struct
+from collections.abc import Iterator
+
+# The local file, in memory or mapped from disk
+Buffer = bytes | mmap.mmap
+
+MIN_BLOCK_SIZE = 2048
+MAX_BLOCK_SIZE = 128 * 1024
+SIGNATURE = struct.Struct(">I16s")  # weak checksum, truncated SHA256
+MAX_LITERAL = 1 << 20
+
+# Runs on the server with the path of the remote copy and the block size as
+# arguments: writes the size and block signatures of the remote copy, then
+# rebuilds the file from the delta and atomically renames it into place.
+REMOTE_HELPER = """\
+import hashlib, itertools, os, stat, struct, sys
+path, size = sys.argv[1], int(sys.argv[2])
+out, inp = sys.stdout.buffer, sys.stdin.buffer
+old = open(path, "rb")
+out.write(struct.pack(">Q", os.fstat(old.fileno()).st_size))
+while block := old.read(size):
+    weak = (sum(block) & 0xFFFF) | (sum(itertools.accumulate(block)) & 0xFFFF) << 16
+    out.write(struct.pack(">I16s", weak, hashlib.sha256(block).digest()[:16]))
+out.flush()
+tmp = path + ".delta-tmp"
+digest = hashlib.sha256()
+try:
+    with open(tmp, "wb") as new:
+        while True:
+            op = inp.read(1)
+            if op == b"C":
+                start, count = struct.unpack(">QI", inp.read(12))
+                old.seek(start * size)
+                for _ in range(count):
+                    chunk = old.read(size)
+                    digest.update(chunk)
+                    new.write(chunk)
+                continue
+            elif op == b"L":
+                chunk = inp.read(struct.unpack(">I", inp.read(4))[0])
+            elif op == b"E":
+                expected = inp.read(32)
+                break
+            else:
+                sys.exit("Incomplete delta")
+            digest.update(chunk)
+            new.write(chunk)
+    if digest.digest() != expected:
+        sys.exit("Checksum mismatch of the rebuilt file")
+    os.chmod(tmp, stat.S_IMODE(os.fstat(old.fileno()).st_mode))
+    os.replace(tmp, path)
+finally:
+    if os.path.exists(tmp):
+        os.remove(tmp)
+"""
+
+
+def block_size(file_size: int) -> int:
+    """Get the delta block size of a file, about the square root of its size."""
+    return min(MAX_BLOCK_SIZE, max(MIN_BLOCK_SIZE, math.isqrt(file_size)))
+
+
+def weak_parts(block: bytes) -> tuple[int, int]:
+    """Get the two halves of the weak rolling checksum of a block."""
+    return sum(block) & 0xFFFF, sum(itertools.accumulate(block)) & 0xFFFF
+
+
+def strong_hash(block: bytes) -> bytes:
+    """Get the strong hash of a block, confirming a weak checksum match."""
+    return hashlib.sha256(block).digest()[:16]
+
+
+def parse_signatures(data: bytes) -> list[tuple[int, bytes]]:
+    """Parse the block signatures written by REMOTE_HELPER."""
+    return list(SIGNATURE.iter_unpack(data))
+
+
+# Delta instructions, before encoding: (COPY, first block index, count) or
+# (LITERAL, offset in the local file, length)
+COPY = b"C"
+LITERAL = b"L"
+DeltaInstruction = tuple[bytes, int, int]
+
+
+def compute_delta(
+    data: Buffer,
+    signatures: list[tuple[int, bytes]],
+    size: int,
+    remote_size: int,
+    max_ratio: float = 0.5,
+) -> list[DeltaInstruction] | None:
+    """Get the delta instructions rebuilding data from the remote copy.
+
+    The remote copy is made of blocks of the given size, its last block being
+    shorter unless remote_size is a multiple of it. Literal data is referred
+    to by its range, so that data may be a memory map of a large file. Return
+    None if more than max_ratio of the data has to be sent as literal, a full
+    upload being cheaper then.
+    """
+    index: dict[int, dict[bytes, int]] = {}
+    for block_index, (weak, strong) in enumerate(signatures):
+        if remote_size - block_index * size >= size:
+            index.setdefault(weak, {}).setdefault(strong, block_index)
+    tail_size = remote_size % size
+    tail = signatures[-1] if signatures and tail_size else None
+
+    instructions: list[DeltaInstruction] = []
+    literal_budget = int(len(data) * max_ratio)
+
+    def add_copy(block_index: int) -> None:
+        if instructions:
+            op, start, count = instructions[-1]
+            if op == COPY and block_index == start + count:
+                instructions[-1] = (COPY, start, count + 1)
+                return
+        instructions.append((COPY, block_index, 1))
+
+    def add_literal(start: int, end: int) -> None:
+        nonlocal literal_budget
+        if start == end:
+            return
+        literal_budget -= end - start
+        instructions.append((LITERAL, start, end - start))
+
+    literal_start = position = 0
+    end = len(data)
+    a, b = weak_parts(data[:size])
+    while position + size <= end:
+        candidates = index.get(a | b << 16)
+        if candidates is not None:
+            block_index = candidates.get(strong_hash(data[position : position + size]))
+            if block_index is not None:
+                add_literal(literal_start, position)
+                add_copy(block_index)
+                position += size
+                literal_start = position
+                a, b = weak_parts(data[position : position + size])
+                continue
+
+        if position - literal_start > literal_budget:
+            return None
+        # Roll the checksum one byte forward
+        if position + size < end:
+            removed, added = data[position], data[position + size]
+            a = (a - removed + added) & 0xFFFF
+            b = (b - size * removed + a) & 0xFFFF
+        position += 1
+
+    if tail is not None and end - tail_size >= literal_start:
+        if strong_hash(data[end - tail_size :]) == tail[1]:
+            add_literal(literal_start, end - tail_size)
+            add_copy(len(signatures) - 1)
+            literal_start = end
+    add_literal(literal_start, end)
+    if literal_budget < 0:
+        return None
+
+    return instructions
+
+
+def encode_delta(
+    data: Buffer, instructions: list[DeltaInstruction], digest: bytes
+) -> Iterator[bytes]:
+    """Encode delta instructions for REMOTE_HELPER, ending with the file digest.
+
+    The literal data is read from data as the instructions are encoded, at
+    most MAX_LITERAL bytes at a time.
+    """
+    for op, start, count in instructions:
+        if op == COPY:
+            yield COPY + struct.pack(">QI", start, count)
+            continue
+        for offset in range(start, start + count, MAX_LITERAL):
+            chunk = data[offset : min(start + count, offset + MAX_LITERAL)]
+            yield LITERAL + struct.pack(">I", len(chunk)) + chunk
+    yield b"E" + digest
@@ -0,0 +1,180 @@
+"""This module keeps track of the files produced by the website builder."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+from json_files import write_json
+
+FileRecord = list[int | str]  # [mtime_ns, size, sha256]
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Get the SHA256 hash of a file, reading it in chunks."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_record(path: str, previous: FileRecord | None = None) -> FileRecord:
+    """Get the record of a file, hashing it only if its mtime or size changed."""
+    stat = os.stat(path)
+    if previous is not None and previous[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return previous[:3]
+    return [stat.st_mtime_ns, stat.st_size, hash_file(path)]
+
+
+class BuildManifest:
+    """Manifest of the sources and outputs of every built animation.
+
+    The manifest is stored inside the destination folder. For each animation
+    it records the content hash of its source files and the list of files
+    written to the destination, so that the next build can skip the
+    animations that did not change and delete the outputs of the removed ones.
+    It also records the files precompressed by the last build, along with
+    the encodings written for each of them.
+    """
+
+    filename = ".build-manifest.json"
+    version = 1
+
+    def __init__(self, destination: str) -> None:
+        """Initialize the manifest and load its content from destination, if any."""
+        self._destination = os.path.normpath(destination)
+        self._path = os.path.join(destination, self.filename)
+        self._entries: dict[str, dict] = {}
+        self.compressed: dict[str, list] = {}
+
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(content, dict) and content.get("version") == self.version:
+            self._entries = content.get("animations", {})
+            self.compressed = content.get("compressed", {})
+
+    def hash_source(
+        self, key: str, source: str, parameters: dict
+    ) -> tuple[str, dict[str, FileRecord]]:
+        """Hash the content of a source folder.
+
+        Files whose modification time and size match the previous build are
+        not read again. The build parameters are part of the hash, so changing
+        them invalidates every entry.
+        """
+        previous = self._entries.get(key, {}).get("files", {})
+        files: dict[str, FileRecord] = {}
+
+        for folder, _, filenames in os.walk(source):
+            for filename in filenames:
+                path = os.path.join(folder, filename)
+                rel_path = os.path.relpath(path, source)
+                files[rel_path] = file_record(path, previous.get(rel_path))
+
+        files = dict(sorted(files.items()))
+        sha = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode())
+        for rel_path, record in files.items():
+            sha.update(f"{rel_path}\0{record[2]}\0".encode())
+
+        return sha.hexdigest(), files
+
+    def is_up_to_date(
+        self, key: str, source_hash: str, staging: dict | None = None
+    ) -> bool:
+        """Check if the outputs of an entry are built from the same sources."""
+        entry = self._entries.get(key)
+        if entry is None or entry["hash"] != source_hash:
+            return False
+        if entry.get("staging") != (staging or {}):
+            return False
+
+        return all(
+            os.path.isfile(os.path.join(self._destination, output))
+            for output in entry["outputs"]
+        )
+
+    def unchanged_files(
+        self, key: str, files: dict[str, FileRecord], staging: dict
+    ) -> set[str]:
+        """Get the source files with the same content as in the previous build.
+
+        Files staged with different options (e.g. link mode) are never
+        reported unchanged.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.get("staging") != staging:
+            return set()
+
+        previous = entry["files"]
+        return {
+            rel_path
+            for rel_path, record in files.items()
+            if rel_path in previous and previous[rel_path][2] == record[2]
+        }
+
+    def outputs(self, key: str) -> list[str]:
+        """Get the outputs recorded for an entry, relative to the destination."""
+        return self._entries.get(key, {}).get("outputs", [])
+
+    def remove_outputs(self, key: str, keep: list[str] | None = None) -> None:
+        """Delete the recorded outputs of an entry, except the ones in keep."""
+        keep_set = set(keep or [])
+        folders = set()
+        for output in self.outputs(key):
+            if output in keep_set:
+                continue
+            path = os.path.join(self._destination, output)
+            if os.path.isfile(path):
+                os.remove(path)
+            folders.add(os.path.dirname(path))
+
+        # remove the folders left empty, deepest first
+        for folder in sorted(folders, key=lambda f: f.count(os.sep), reverse=True):
+            while folder != self._destination and os.path.isdir(folder):
+                if os.listdir(folder):
+                    break
+                os.rmdir(folder)
+                folder = os.path.dirname(folder)
+
+    def record(
+        self,
+        key: str,
+        source_hash: str,
+        files: dict[str, FileRecord],
+        outputs: list[str],
+        staging: dict | None = None,
+    ) -> None:
+        """Store the sources and outputs of an entry."""
+        self._entries[key] = {
+            "hash": source_hash,
+            "files": files,
+            "outputs": sorted(outputs),
+            "staging": staging or {},
+        }
+
+    def prune(self, keys: list[str]) -> list[str]:
+        """Delete the outputs of the entries not in keys and forget them.
+
+        Return the removed keys.
+        """
+        removed = sorted(set(self._entries) - set(keys))
+        for key in removed:
+            self.remove_outputs(key)
+            del self._entries[key]
+
+        return removed
+
+    def save(self) -> None:
+        """Write the manifest to the destination folder."""
+        content = {
+            "version": self.version,
+            "animations": self._entries,
+            "compressed": self.compressed,
+        }
+        write_json(self._path, content)
@@ -3,22 +3,69 @@
 import argparse
 import os
 import shutil
+import time
 import warnings
 from datetime import datetime
+from functools import cached_property, partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from random import Random
+from stat import S_ISREG
+from threading import Thread
 
+from build_manifest import BuildManifest, FileRecord, file_record, hash_file
+from folder_watcher import InotifyWatcher, create_watcher, debounced_changes
+from instrumentation import add_arguments, instrumented, span
 from jinja2 import Environment, FileSystemLoader
 from load_animations import Animation, AnimationsLoader
-from PIL import Image
+from precompress import (
+    compress_files,
+    is_compressible,
+    remove_htaccess,
+    remove_siblings,
+    write_htaccess,
+)
+from previews import (
+    REDUCING_GAP,
+    SAVE_OPTIONS,
+    PreviewTask,
+    PreviewVariant,
+    ThumbnailCache,
+    transcode_previews,
+)
+from shared_assets import SHARED_FOLDER, find_shared_assets, rewrite_references
+from staging import LINK_MODES, stage_file, write_file
 
 
 class WebsiteBuilder:
     """Class to build the website."""
 
-    def __init__(self, destination: str, randomize: bool, seed: int | None) -> None:
+    # the preview_size WEBP variant is the fallback for browsers without srcset
+    preview_size = 500
+    preview_sizes = [250, 500]
+    preview_formats = {"AVIF": 60, "WEBP": 80}
+    thumbnail_cache = ".thumbnail-cache"
+
+    def __init__(
+        self,
+        destination: str,
+        randomize: bool,
+        seed: int | None,
+        use_cache: bool = True,
+        jobs: int = 1,
+        thumbnail_cache_size: int = 256 * 1024 * 1024,
+        link_mode: str = "copy",
+        precompress: bool = False,
+        min_saving: float = 0.1,
+    ) -> None:
         """Initialize the WebsiteBuilder."""
         self._destination = destination
         self._randomize = randomize
+        self._use_cache = use_cache
+        self._jobs = jobs
+        self._thumbnail_cache_size = thumbnail_cache_size
+        self._link_mode = link_mode
+        self._precompress = precompress
+        self._min_saving = min_saving
 
         if seed is None:
             seed = int(datetime.now().timestamp() * 1000)
@@ -26,21 +73,59 @@ class WebsiteBuilder:
         self._seed = seed
         self._random = Random(seed)
 
-    def _png_to_webp(self, animation: Animation) -> str | None:
-        """Get the webp version of the preview image if it exists."""
+    @cached_property
+    def _animations(self) -> list[Animation]:
+        """Load the animations once, sharing their parsed metadata across steps."""
+        cache_path = AnimationsLoader.cache_file if self._use_cache else None
+        with span("load"):
+            return list(AnimationsLoader.load_animations(cache_path))
+
+    def _preview_variants(self, animation: Animation) -> list[PreviewVariant]:
+        """Get the sizes and formats in which the preview image is encoded."""
+        rel_preview = os.path.relpath(animation.preview, animation.path)
+        stem = os.path.splitext(rel_preview)[0]
+
+        variants = []
+        for image_format, quality in self.preview_formats.items():
+            for size in self.preview_sizes:
+                suffix = "" if size == self.preview_size else f"-{size}"
+                name = f"{stem}{suffix}.{image_format.lower()}"
+                variants.append(
+                    PreviewVariant(
+                        destination=os.path.join(
+                            self._destination, animation.folder, name
+                        ),
+                        size=size,
+                        format=image_format,
+                        quality=quality,
+                    )
+                )
+
+        return variants
+
+    def _preview_sources(self, animation: Animation) -> tuple[str | None, list[dict]]:
+        """Get the fallback preview and the srcset of each format, if built."""
         if animation.preview is None:
-            return None
+            return None, []
 
-        webp_preview = animation.preview.replace(".png", ".webp")
-        webp_path = os.path.join(
-            self._destination,
-            animation.folder,
-            os.path.basename(webp_preview),
-        )
-        if os.path.isfile(webp_path):
-            return webp_path.replace(self._destination + "/", "")
+        fallback = None
+        srcsets: dict[str, list[str]] = {}
+        for variant in self._preview_variants(animation):
+            if not os.path.isfile(variant.destination):
+                continue
+
+            path = os.path.relpath(variant.destination, self._destination)
+            srcsets.setdefault(variant.mime_type, []).append(
+                f"{path} {variant.size}w"
+            )
+            if variant.size == self.preview_size and variant.format == "WEBP":
+                fallback = path
 
-        return None
+        sources = [
+            {"type": mime_type, "srcset": ", ".join(srcset)}
+            for mime_type, srcset in srcsets.items()
+        ]
+        return fallback, sources
 
     def build_structure(self) -> None:
         """Create the website in the dest/ folder."""
@@ -55,42 +140,235 @@ class WebsiteBuilder:
         os.remove(f"{self._destination}/index_template.html")
         print(f"Created website in {self._destination}/ folder")
 
-    def build_animations(self) -> None:
-        """Copy animations and their preview images to the destination folder."""
-        for animation in AnimationsLoader.load_animations():
-            print(f"Processing animation: {animation.title}")
-            if animation.preview is None:
+    def _build_parameters(self) -> dict:
+        """Get the parameters used to encode the preview images."""
+        return {
+            "size": self.preview_size,
+            "sizes": self.preview_sizes,
+            "formats": self.preview_formats,
+            "reducing_gap": REDUCING_GAP,
+            "options": SAVE_OPTIONS,
+        }
+
+    def _animation_outputs(
+        self, animation: Animation, files: list[str], mapping: dict[str, str]
+    ) -> list[str]:
+        """Get the files written for an animation, relative to the destination."""
+        preview = os.path.relpath(animation.preview, animation.path)
+        outputs = [
+            os.path.join(animation.folder, rel_path)
+            for rel_path in files
+            if rel_path != preview and rel_path not in mapping
+        ]
+        for variant in self._preview_variants(animation):
+            outputs.append(os.path.relpath(variant.destination, self._destination))
+
+        return outputs
+
+    def _stage_animation(
+        self,
+        animation: Animation,
+        files: dict[str, FileRecord],
+        unchanged: set[str],
+        mapping: dict[str, str],
+    ) -> tuple[int, int]:
+        """Stage the files of an animation, except the preview image.
+
+        The files moved to the shared folder are left out, and the references
+        to them are rewritten. Return the number of staged and skipped files.
+        """
+        preview = os.path.relpath(animation.preview, animation.path)
+        dest_folder = os.path.join(self._destination, animation.folder)
+        staged = skipped = 0
+
+        for rel_path in files:
+            if rel_path == preview or rel_path in mapping:
+                continue
+
+            destination = os.path.join(dest_folder, rel_path)
+            if rel_path in unchanged and os.path.lexists(destination):
+                skipped += 1
                 continue
 
-            # copy the folder to the destination
-            dest_folder = os.path.join(self._destination, animation.folder)
-            shutil.copytree(
-                animation.path,
-                dest_folder,
-                dirs_exist_ok=True,
+            source = os.path.join(animation.path, rel_path)
+            staged += 1
+            if mapping and os.path.splitext(rel_path)[1] in [".html", ".js"]:
+                with open(source, "rb") as f:
+                    content = f.read()
+                try:
+                    text = content.decode("utf-8")
+                except UnicodeDecodeError:
+                    text = None
+
+                if text is not None:
+                    rewritten = rewrite_references(
+                        text, rel_path, animation.folder, mapping
+                    )
+                    if rewritten != text:
+                        write_file(destination, rewritten.encode("utf-8"))
+                        continue
+
+            stage_file(source, destination, self._link_mode)
+
+        return staged, skipped
+
+    @staticmethod
+    def _is_intact_copy(path: str, sha: str) -> bool:
+        """Check if a file is an unlinked copy with the given SHA256 hash."""
+        try:
+            stat = os.lstat(path)
+        except FileNotFoundError:
+            return False
+        if not S_ISREG(stat.st_mode) or stat.st_nlink > 1:
+            return False
+        return hash_file(path) == sha
+
+    def _stage_shared_assets(
+        self,
+        manifest: BuildManifest,
+        shared: dict[str, str],
+        sources: dict[str, str],
+    ) -> None:
+        """Write one copy of each shared asset and drop the unused ones.
+
+        Shared assets are named after their content, so they are always real
+        copies: a link would follow later edits of the animation it came
+        from. An existing asset is written again if it is a link or if its
+        content does not match its hash.
+        """
+        outputs = sorted(shared.values())
+        for sha, path in shared.items():
+            destination = os.path.join(self._destination, path)
+            if not self._is_intact_copy(destination, sha):
+                stage_file(sources[sha], destination, "copy")
+
+        manifest.remove_outputs(SHARED_FOLDER, keep=outputs)
+        manifest.record(SHARED_FOLDER, "", {}, outputs)
+        print(f"Shared {len(outputs)} assets between animations")
+
+    def build_animations(self) -> None:
+        """Copy animations and their preview images to the destination folder.
+
+        Animations whose sources did not change since the previous build are
+        skipped, and the outputs of the removed animations are deleted. The
+        js and css files found in several animations are written once in the
+        shared folder.
+        """
+        animations = self._animations
+        manifest = BuildManifest(self._destination)
+        tasks = []
+        pending = {}
+        staged_files = 0
+        skipped_files = 0
+
+        hashed = []
+        with span("hash"):
+            for animation in animations:
+                if animation.preview is None:
+                    print(f"Skipping animation without preview: {animation.title}")
+                    continue
+
+                with span(animation.folder):
+                    source_hash, files = manifest.hash_source(
+                        animation.folder, animation.path, self._build_parameters()
+                    )
+                hashed.append((animation, source_hash, files))
+
+            shared = find_shared_assets(
+                {
+                    animation.path: {
+                        path: str(record[2]) for path, record in files.items()
+                    }
+                    for animation, _, files in hashed
+                }
             )
+        shared_sources = {}
+
+        with span("copy"):
+            for animation, source_hash, files in hashed:
+                print(f"Processing animation: {animation.title}")
+
+                mapping = {}
+                for rel_path, record in files.items():
+                    sha = str(record[2])
+                    if sha in shared:
+                        mapping[rel_path] = shared[sha]
+                        shared_sources.setdefault(
+                            sha, os.path.join(animation.path, rel_path)
+                        )
+                staging = {"link_mode": self._link_mode, "shared": mapping}
+
+                if manifest.is_up_to_date(animation.folder, source_hash, staging):
+                    print(f"Animation {animation.title} is up to date, skipping.")
+                    continue
 
-            # Load the image
-            img = Image.open(animation.preview)
-            # Check if the image is square
-            if abs(1 - (img.height / img.width)) > 0.1:
-                warnings.warn(
-                    f"Preview image for animation '{animation.title}' "
-                    "is not approximately square.",
+                # remove the outputs that will not be written again
+                outputs = self._animation_outputs(animation, list(files), mapping)
+                manifest.remove_outputs(animation.folder, keep=outputs)
+
+                # stage the changed files, except the preview which is transcoded
+                unchanged = manifest.unchanged_files(animation.folder, files, staging)
+                with span(animation.folder):
+                    staged, skipped = self._stage_animation(
+                        animation, files, unchanged, mapping
+                    )
+                staged_files += staged
+                skipped_files += skipped
+
+                preview = os.path.relpath(animation.preview, animation.path)
+                tasks.append(
+                    PreviewTask(
+                        title=animation.title,
+                        source=animation.preview,
+                        source_hash=str(files[preview][2]),
+                        variants=self._preview_variants(animation),
+                    )
+                )
+                pending[animation.preview] = (
+                    animation.folder,
+                    source_hash,
+                    files,
+                    outputs,
+                    staging,
                 )
 
-            # resize the image to have a width of 500 pixels
-            img = img.resize((500, 500))
+            self._stage_shared_assets(manifest, shared, shared_sources)
+
+        with span("transcode"):
+            cache = None
+            if self._use_cache:
+                cache = ThumbnailCache(self.thumbnail_cache, self._thumbnail_cache_size)
+
+            failed = []
+            for result in transcode_previews(tasks, self._jobs, cache):
+                if result.error is not None:
+                    failed.append(result.task.title)
+                    print(
+                        f"Failed to transcode preview image for animation "
+                        f"'{result.task.title}': {result.error}"
+                    )
+                    continue
+
+                if not result.square:
+                    warnings.warn(
+                        f"Preview image for animation '{result.task.title}' "
+                        "is not approximately square.",
+                    )
+                manifest.record(*pending[result.task.source])
 
-            # rename the image as wepb
-            old_name = os.path.basename(animation.preview)
-            new_name = old_name.replace(".png", ".webp")
-            # save the image as webp and remove the png
-            img.save(f"{dest_folder}/{new_name}", "WEBP")
-            os.remove(f"{dest_folder}/{old_name}")
+        built = [animation.folder for animation, _, _ in hashed] + [SHARED_FOLDER]
+        for folder in manifest.prune(built):
+            print(f"Removed animation: {folder}")
 
+        manifest.save()
+        print(f"Staged {staged_files} files, {skipped_files} unchanged files skipped")
         print(f"Copied preview images to {self._destination}/animations/")
 
+        if failed:
+            raise RuntimeError(
+                f"Failed to transcode the preview images of: {', '.join(failed)}"
+            )
+
     def build_index(self) -> None:
         """Create the index.html file from the template."""
         env = Environment(loader=FileSystemLoader("homepage/"))
@@ -99,20 +377,21 @@ class WebsiteBuilder:
         html = ""
         default_preview = "./assets/placeholder.png"
 
-        animations = list(AnimationsLoader.load_animations())
+        animations = list(self._animations)
         if self._randomize:
             self._random.shuffle(animations)
 
         output = []
 
         for animation in animations:
-            # replace the preview with webp version
-            preview = self._png_to_webp(animation) or default_preview
+            # replace the preview with its transcoded variants
+            preview, sources = self._preview_sources(animation)
             delay = self._random.uniform(0.1, 1)
             output.append(
                 {
                     "path": animation.folder,
-                    "preview": preview,
+                    "preview": preview or default_preview,
+                    "sources": sources,
                     "title": animation.title,
                     "delay": delay,
                 }
@@ -123,11 +402,159 @@ class WebsiteBuilder:
             f.write(html)
         print("Created index.html file")
 
+    def _compressible_files(self) -> list[str]:
+        """Get the compressible files of the website, relative to the destination."""
+        compressible = []
+        for folder, _, filenames in os.walk(self._destination):
+            for filename in filenames:
+                if filename.startswith(".") or not is_compressible(filename):
+                    continue
+                path = os.path.join(folder, filename)
+                compressible.append(os.path.relpath(path, self._destination))
+
+        return sorted(compressible)
+
+    def build_precompressed(self) -> None:
+        """Write gzip and brotli siblings of the compressible files.
+
+        Files whose content did not change since the previous build are not
+        compressed again, and the siblings of removed files are deleted.
+        """
+        manifest = BuildManifest(self._destination)
+        previous = manifest.compressed
+        records = {}
+        to_compress = []
+
+        for rel_path in self._compressible_files():
+            path = os.path.join(self._destination, rel_path)
+            old = previous.get(rel_path)
+            record = file_record(path, old[:3] if old else None)
+
+            if (
+                old is not None
+                and old[2] == record[2]
+                and all(os.path.isfile(path + ext) for ext in old[3])
+            ):
+                records[rel_path] = record + [old[3]]
+            else:
+                records[rel_path] = record
+                to_compress.append(rel_path)
+
+        paths = [os.path.join(self._destination, f) for f in to_compress]
+        for rel_path, written in zip(
+            to_compress, compress_files(paths, self._min_saving, self._jobs)
+        ):
+            records[rel_path].append(written)
+
+        for rel_path in set(previous) - set(records):
+            remove_siblings(os.path.join(self._destination, rel_path))
+
+        manifest.compressed = records
+        manifest.save()
+        write_htaccess(self._destination)
+        print(
+            f"Precompressed {len(to_compress)} files, "
+            f"{len(records) - len(to_compress)} unchanged files skipped"
+        )
+
+    def remove_precompressed(self) -> None:
+        """Delete the siblings written by a previous precompressed build."""
+        manifest = BuildManifest(self._destination)
+        if not manifest.compressed:
+            return
+
+        for rel_path in manifest.compressed:
+            remove_siblings(os.path.join(self._destination, rel_path))
+        remove_htaccess(self._destination)
+
+        manifest.compressed = {}
+        manifest.save()
+        print("Removed precompressed files")
+
     def build(self) -> None:
         """Build the complete website."""
-        self.build_structure()
-        self.build_animations()
-        self.build_index()
+        with span("structure"):
+            self.build_structure()
+        with span("animations"):
+            self.build_animations()
+        with span("index"):
+            self.build_index()
+        with span("precompress"):
+            if self._precompress:
+                self.build_precompressed()
+            else:
+                self.remove_precompressed()
+
+    def rebuild(self, changed: set[str]) -> None:
+        """Rebuild the parts of the website affected by the changed paths.
+
+        The animations are reloaded and built again, which stages and
+        transcodes the changed ones only, and the index is rendered again.
+        The homepage is copied again unless only its template changed.
+        """
+        folders = {path.split(os.sep)[0] for path in changed}
+        template = os.path.join("homepage", "index_template.html")
+        homepage = "homepage" in folders and changed != {template}
+        animations = AnimationsLoader.animations_folder in folders
+
+        if homepage:
+            with span("structure"):
+                self.build_structure()
+        if animations:
+            # the animations may have been added, removed or edited
+            self.__dict__.pop("_animations", None)
+            with span("animations"):
+                self.build_animations()
+        with span("index"):
+            self.build_index()
+        if self._precompress:
+            with span("precompress"):
+                self.build_precompressed()
+
+
+def serve(destination: str, port: int) -> ThreadingHTTPServer:
+    """Serve the destination folder on localhost from a background thread."""
+
+    class Handler(SimpleHTTPRequestHandler):
+        def end_headers(self) -> None:
+            # always get the latest build when refreshing the page
+            self.send_header("Cache-Control", "no-store")
+            super().end_headers()
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(
+        ("localhost", port), partial(Handler, directory=destination)
+    )
+    Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {destination}/ on http://localhost:{server.server_port}/")
+    return server
+
+
+def watch(builder: WebsiteBuilder, debounce: float) -> None:
+    """Rebuild the website whenever its sources change, until interrupted."""
+    watcher = create_watcher([AnimationsLoader.animations_folder, "homepage"])
+    kind = "inotify" if isinstance(watcher, InotifyWatcher) else "polling"
+    print(f"Watching for changes ({kind}), press Ctrl+C to stop")
+
+    try:
+        for changed in debounced_changes(watcher, debounce):
+            started = time.perf_counter()
+            try:
+                builder.rebuild(changed)
+            except Exception as e:
+                # keep watching, the next save will likely fix the error
+                print(f"Rebuild failed: {e}")
+                continue
+            print(
+                f"Rebuilt {len(changed)} changed paths "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
 
 def main() -> None:
@@ -152,15 +579,87 @@ def main() -> None:
         default=None,
         help="Random seed for animation selection",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore the animations metadata cache and the thumbnail cache",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to transcode the preview images",
+    )
+    parser.add_argument(
+        "--thumbnail-cache-size",
+        type=int,
+        default=256,
+        help="Maximum size of the thumbnail cache, in MB",
+    )
+    parser.add_argument(
+        "--link-mode",
+        choices=LINK_MODES,
+        default="copy",
+        help="How the animation files are placed in the destination folder",
+    )
+    parser.add_argument(
+        "--precompress",
+        action="store_true",
+        help="Write gzip and brotli versions of the compressible files",
+    )
+    parser.add_argument(
+        "--precompress-min-saving",
+        type=float,
+        default=0.1,
+        help="Minimum size reduction (fraction) for a compressed file to be kept",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Rebuild the changed animations and the index whenever "
+        "the animations or the homepage change",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.1,
+        help="Seconds without changes to wait for before rebuilding (--watch)",
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        nargs="?",
+        const=8000,
+        default=None,
+        metavar="PORT",
+        help="Serve the website on localhost while watching (default port 8000)",
+    )
+    add_arguments(parser)
     args = parser.parse_args()
+    if args.serve is not None and not args.watch:
+        parser.error("--serve requires --watch")
 
     builder = WebsiteBuilder(
         destination=args.destination,
         randomize=args.randomize,
         seed=args.seed,
+        use_cache=not args.no_cache,
+        jobs=args.jobs,
+        thumbnail_cache_size=args.thumbnail_cache_size * 1024 * 1024,
+        link_mode=args.link_mode,
+        precompress=args.precompress,
+        min_saving=args.precompress_min_saving,
     )
 
-    builder.build()
+    with instrumented(args):
+        builder.build()
+        if args.watch:
+            server = None
+            if args.serve is not None:
+                server = serve(args.destination, args.serve)
+            watch(builder, args.debounce)
+            if server is not None:
+                server.shutdown()
 
 
 if __name__ == "__main__":
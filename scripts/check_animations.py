@@ -1,23 +1,140 @@
 """This script checks for issues in the animation folders."""
 
+import argparse
+import json
+import time
 import warnings
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
 
-from load_animations import AnimationsLoader
+from instrumentation import add_arguments, instrumented, record, span
+from load_animations import Animation, AnimationsLoader, Issue
+from parallel import map_jobs
 
 
-def main() -> None:
-    """Script entry point."""
+@dataclass
+class CheckResult:
+    """Issues and per-rule timings of a single checked animation."""
+
+    animation: str
+    issues: list[Issue]
+    timings: dict[str, float]
+
+
+def _ignore_loader_warnings() -> None:
+    """Silence the warnings emitted while loading the animations."""
     warnings.filterwarnings(action="ignore", module="load_animations")
 
-    issues_found = False
+
+def check_animation(animation: Animation) -> CheckResult:
+    """Check a single animation, recording the time spent on each rule."""
+    timings: dict[str, float] = {}
+    issues = animation.find_issues(timings)
+    return CheckResult(animation.name, issues, timings)
+
+
+def check_animations(animations: list[Animation], jobs: int) -> list[CheckResult]:
+    """Check all the animations, in the same order."""
+    return map_jobs(check_animation, animations, jobs, _ignore_loader_warnings)
+
+
+def rule_timings(results: list[CheckResult]) -> dict[str, float]:
+    """Sum the time spent on each rule across all the animations."""
+    timings: dict[str, float] = {}
+    for result in results:
+        for rule, elapsed in result.timings.items():
+            timings[rule] = timings.get(rule, 0) + elapsed
+
+    return dict(sorted(timings.items(), key=lambda t: t[1], reverse=True))
+
+
+def write_json_report(path: str, results: list[CheckResult], duration: float) -> None:
+    """Write the check results to a JSON file."""
+    report = {
+        "animations": len(results),
+        "duration": duration,
+        "rule_timings": rule_timings(results),
+        "issues": [asdict(issue) for result in results for issue in result.issues],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+def write_junit_report(path: str, results: list[CheckResult], duration: float) -> None:
+    """Write the check results to a JUnit XML file.
+
+    Each animation is a test suite and each rule is a test case.
+    """
+    failures = sum(len(result.issues) > 0 for result in results)
+    root = ET.Element(
+        "testsuites",
+        name="check-animations",
+        tests=str(len(results)),
+        failures=str(failures),
+        time=f"{duration:.6f}",
+    )
+    for result in results:
+        suite = ET.SubElement(
+            root,
+            "testsuite",
+            name=result.animation,
+            tests=str(len(result.timings)),
+            failures=str(len({issue.rule for issue in result.issues})),
+            time=f"{sum(result.timings.values()):.6f}",
+        )
+        for rule, elapsed in result.timings.items():
+            case = ET.SubElement(
+                suite,
+                "testcase",
+                classname=result.animation,
+                name=rule,
+                time=f"{elapsed:.6f}",
+            )
+            for issue in result.issues:
+                if issue.rule != rule:
+                    continue
+                failure = ET.SubElement(
+                    case, "failure", type=issue.severity, message=issue.message
+                )
+                failure.text = issue.file
+
+    ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def run(args: argparse.Namespace) -> None:
+    """Check the animations and report their issues."""
+    _ignore_loader_warnings()
+
+    cache_path = None if args.no_cache else AnimationsLoader.cache_file
+
+    started = time.perf_counter()
+    with span("load"):
+        animations = list(AnimationsLoader.load_animations(cache_path))
+    with span("check"):
+        results = check_animations(animations, args.jobs)
+        # The rules may run in worker processes, add up their timings here
+        for result in results:
+            record(sum(result.timings.values()), result.animation)
+            for rule, elapsed in result.timings.items():
+                record(elapsed, result.animation, rule)
+    duration = time.perf_counter() - started
+
     issued_animations = set()
-    for animations in AnimationsLoader.load_animations():
-        if animations.check_issues():
-            issues_found = True
-            issued_animations.add(animations.name)
+    for result in results:
+        for issue in result.issues:
+            print(issue)
+        if result.issues:
+            issued_animations.add(result.animation)
+
+    if args.report is not None:
+        if args.report_format == "junit":
+            write_junit_report(args.report, results, duration)
+        else:
+            write_json_report(args.report, results, duration)
+        print(f"Report written to {args.report}")
 
     print(f"Checked {AnimationsLoader.count_animations()} animations.")
-    if issues_found:
+    if issued_animations:
         print("The following animations have issues:")
         print(", ".join(sorted(issued_animations)))
         raise RuntimeError("Some animations have issues. Please check the logs above.")
@@ -25,5 +142,40 @@ def main() -> None:
     print("All animations are correctly set up.")
 
 
+def main() -> None:
+    """Script entry point."""
+    parser = argparse.ArgumentParser(
+        description="Check for issues in the animation folders.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Scan every animation from scratch, ignoring the metadata cache",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to check the animations",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Path of the report file to write",
+    )
+    parser.add_argument(
+        "--report-format",
+        choices=["json", "junit"],
+        default="json",
+        help="Format of the report file",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented(args):
+        run(args)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,164 @@
+"""This module records the operations of the website publisher."""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import math
+import time
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+
+import instrumentation
+
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class Operation:
+    """A single operation of a publication, e.g. a file upload."""
+
+    kind: str
+    path: str
+    outcome: str
+    size: int
+    started: float
+    duration: float
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Get a percentile of values, using the nearest-rank method."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class DeployMetrics:
+    """Operations recorded during a publication, with their timings and outcome.
+
+    Operations are grouped by kind (hash, upload, mkdir, ...), and the outcome
+    tells whether an operation succeeded, failed or was skipped. The time of
+    the operations that were not skipped is also added to the span of their
+    kind.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the metrics, starting the publication clock."""
+        self.operations: list[Operation] = []
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def measure(self, kind: str, path: str = "", size: int = 0) -> Iterator[Operation]:
+        """Time the operation run inside the context.
+
+        The outcome defaults to "done" and can be changed through the yielded
+        operation. It is set to failed if the context raises.
+        """
+        operation = Operation(kind, path, "done", size, time.perf_counter(), 0.0)
+        try:
+            with instrumentation.span(kind):
+                yield operation
+        except BaseException:
+            operation.outcome = FAILED
+            raise
+        finally:
+            operation.duration = time.perf_counter() - operation.started
+            self.operations.append(operation)
+
+    def record(
+        self,
+        kind: str,
+        path: str,
+        outcome: str,
+        size: int = 0,
+        duration: float = 0.0,
+    ) -> None:
+        """Record an operation that was timed elsewhere, or not at all."""
+        started = time.perf_counter() - duration
+        self.operations.append(Operation(kind, path, outcome, size, started, duration))
+        if outcome != SKIPPED:
+            instrumentation.record(duration, kind)
+
+    @property
+    def failures(self) -> int:
+        """Get the number of failed operations."""
+        return sum(operation.outcome == FAILED for operation in self.operations)
+
+    def summary(self) -> dict:
+        """Summarize the operations of each kind.
+
+        The throughput is computed over the time span of the operations of a
+        kind, as they run concurrently.
+        """
+        by_kind: dict[str, list[Operation]] = {}
+        for operation in self.operations:
+            by_kind.setdefault(operation.kind, []).append(operation)
+
+        kinds = {}
+        for kind, operations in sorted(by_kind.items()):
+            outcomes: dict[str, int] = {}
+            for operation in operations:
+                outcomes[operation.outcome] = outcomes.get(operation.outcome, 0) + 1
+
+            done = [o for o in operations if o.outcome != SKIPPED]
+            durations = [o.duration for o in done]
+            transferred = sum(o.size for o in done)
+            span = (
+                max(o.started + o.duration for o in done)
+                - min(o.started for o in done)
+                if done
+                else 0.0
+            )
+            kinds[kind] = {
+                "count": len(operations),
+                "outcomes": outcomes,
+                "bytes": transferred,
+                "p50": percentile(durations, 0.5),
+                "p95": percentile(durations, 0.95),
+                "throughput": transferred / span if span > 0 else 0.0,
+                "skip_ratio": outcomes.get(SKIPPED, 0) / len(operations),
+            }
+
+        return {
+            "duration": time.perf_counter() - self._started,
+            "failures": self.failures,
+            "operations": kinds,
+        }
+
+    def log_summary(self) -> None:
+        """Log the summary of the operations of each kind."""
+        summary = self.summary()
+        for kind, stats in summary["operations"].items():
+            outcomes = ", ".join(
+                f"{count} {outcome}"
+                for outcome, count in sorted(stats["outcomes"].items())
+            )
+            logging.info(
+                "%s: %s; %.1f kB at %.1f kB/s; p50 %.1f ms, p95 %.1f ms; "
+                "%.0f%% skipped",
+                kind,
+                outcomes,
+                stats["bytes"] / 1024,
+                stats["throughput"] / 1024,
+                stats["p50"] * 1000,
+                stats["p95"] * 1000,
+                stats["skip_ratio"] * 100,
+            )
+        logging.info(
+            "Publication took %.2fs, %d operations failed",
+            summary["duration"],
+            summary["failures"],
+        )
+
+    def write_json(self, path: str) -> None:
+        """Write the summary and every recorded operation to a JSON file."""
+        report = self.summary()
+        report["details"] = [
+            dict(asdict(operation), started=operation.started - self._started)
+            for operation in self.operations
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
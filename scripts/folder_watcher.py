@@ -0,0 +1,188 @@
+"""This module watches folders for changes, with inotify or by polling."""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from collections.abc import Iterator
+
+# inotify event flags, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+def _walk(root: str) -> Iterator[tuple[str, list[str]]]:
+    """Walk the visible folders under root, yielding each with its files."""
+    for folder, dirnames, filenames in os.walk(root):
+        # hidden entries are skipped, just like the animations scan does
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        yield folder, [f for f in filenames if not f.startswith(".")]
+
+
+class PollingWatcher:
+    """Watches folders by comparing the modification time and size of their files."""
+
+    def __init__(self, roots: list[str], interval: float = 0.25) -> None:
+        """Initialize the watcher with a first snapshot of the roots."""
+        self._roots = roots
+        self._interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> dict[str, tuple[int, int]]:
+        """Get the modification time and size of every file and folder."""
+        snapshot = {}
+        for root in self._roots:
+            for folder, filenames in _walk(root):
+                for path in [folder] + [os.path.join(folder, f) for f in filenames]:
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self, timeout: float | None = None) -> set[str]:
+        """Wait for changes, at most timeout seconds, and get the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            changed = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changed:
+                return changed
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = self._interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+    def close(self) -> None:
+        """Stop watching."""
+
+
+class InotifyWatcher:
+    """Watches folders with Linux inotify, adding the folders created later on."""
+
+    def __init__(self, roots: list[str]) -> None:
+        """Initialize the watcher, raising OSError if inotify is not available."""
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._roots = roots
+        self._folders: dict[int, str] = {}
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        try:
+            for root in roots:
+                self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, root: str) -> list[str]:
+        """Watch a folder and its subfolders, returning the files found inside."""
+        files = []
+        for folder, filenames in _walk(root):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"Cannot watch {folder}: {os.strerror(errno)}")
+            self._folders[wd] = folder
+            files.extend(os.path.join(folder, f) for f in filenames)
+        return files
+
+    def changes(self, timeout: float | None = None) -> set[str]:
+        """Wait for changes, at most timeout seconds, and get the changed paths."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, consider that everything changed
+                    changed.update(self._roots)
+                    continue
+                if mask & IN_IGNORED:
+                    self._folders.pop(wd, None)
+                    continue
+                folder = self._folders.get(wd)
+                if folder is None or name.startswith("."):
+                    continue
+
+                path = os.path.join(folder, name)
+                changed.add(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may be written before the new folder is watched
+                    with_files = self._add_tree(path) if os.path.isdir(path) else []
+                    changed.update(with_files)
+
+        return changed
+
+    def close(self) -> None:
+        """Stop watching."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(roots: list[str]) -> InotifyWatcher | PollingWatcher:
+    """Watch the existing roots with inotify, falling back to polling."""
+    roots = [root for root in roots if os.path.isdir(root)]
+    try:
+        return InotifyWatcher(roots)
+    except (OSError, AttributeError):
+        # AttributeError: the C library has no inotify functions (not Linux)
+        return PollingWatcher(roots)
+
+
+def debounced_changes(
+    watcher: InotifyWatcher | PollingWatcher, delay: float
+) -> Iterator[set[str]]:
+    """Yield the changed paths, once no change happened for delay seconds.
+
+    A burst of saves (e.g. an editor writing several files) is yielded as a
+    single set of changes.
+    """
+    while True:
+        changed = watcher.changes()
+        if not changed:
+            continue
+        while more := watcher.changes(delay):
+            changed |= more
+        yield changed
@@ -0,0 +1,137 @@
+"""This module times the stages of the scripts and profiles their runs.
+
+Stages are timed with nested spans: the time of each span is added to the
+path made of the names of its enclosing spans, so that the same stage run
+for every animation or file adds up in a single entry. The current path is
+held in a context variable, so spans nest correctly across asyncio tasks
+and worker threads.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import cProfile
+import time
+from collections.abc import Iterator
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+SpanPath = tuple[str, ...]
+
+
+@dataclass
+class SpanStats:
+    """Accumulated time of the spans sharing a path."""
+
+    total: float = 0.0
+    count: int = 0
+    slowest: float = 0.0
+
+
+_current: ContextVar[SpanPath] = ContextVar("span_path", default=())
+_spans: dict[SpanPath, SpanStats] = {}
+
+
+def record(duration: float, *names: str) -> None:
+    """Add a duration timed elsewhere, e.g. in a worker, under the current span."""
+    stats = _spans.setdefault(_current.get() + names, SpanStats())
+    stats.total += duration
+    stats.count += 1
+    stats.slowest = max(stats.slowest, duration)
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the code run inside the context as a child of the current span."""
+    token = _current.set(_current.get() + (name,))
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        _current.reset(token)
+        record(duration, name)
+
+
+def total(*names: str) -> float:
+    """Get the total time recorded under a path."""
+    stats = _spans.get(names)
+    return stats.total if stats is not None else 0.0
+
+
+def reset() -> None:
+    """Forget every recorded span."""
+    _spans.clear()
+
+
+def slowest_spans(top: int) -> list[tuple[SpanPath, SpanStats]]:
+    """Get the paths with the longest total time, slowest first."""
+    return sorted(_spans.items(), key=lambda item: item[1].total, reverse=True)[:top]
+
+
+def print_timings(top: int) -> None:
+    """Print the slowest stages, with their number of runs."""
+    print(f"Slowest {top} stages:")
+    for path, stats in slowest_spans(top):
+        print(
+            f"{stats.total:>10.3f}s {stats.count:>7}x "
+            f"{stats.slowest:>9.3f}s max  {' > '.join(path)}"
+        )
+
+
+def write_folded(path: str) -> None:
+    """Write the self time of every span path as folded stacks.
+
+    Each line holds a ';'-separated path and its time in microseconds, the
+    input format of flamegraph.pl and speedscope. Spans run concurrently may
+    last less than their children, their self time is then zero.
+    """
+    children: dict[SpanPath, float] = {}
+    for span_path, stats in _spans.items():
+        if span_path[:-1]:
+            children[span_path[:-1]] = children.get(span_path[:-1], 0) + stats.total
+
+    with open(path, "w", encoding="utf-8") as f:
+        for span_path, stats in sorted(_spans.items()):
+            own = max(0.0, stats.total - children.get(span_path, 0.0))
+            f.write(f"{';'.join(span_path)} {round(own * 1e6)}\n")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the --profile and --timings options to a script."""
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        metavar="PREFIX",
+        help="Profile the run, writing PREFIX.pstats (cProfile) and "
+        "PREFIX.folded (stage timings as folded stacks for flame graphs)",
+    )
+    parser.add_argument(
+        "--timings",
+        type=int,
+        nargs="?",
+        const=20,
+        default=None,
+        metavar="N",
+        help="Print the N slowest stages at the end of the run (default 20)",
+    )
+
+
+@contextlib.contextmanager
+def instrumented(args: argparse.Namespace) -> Iterator[None]:
+    """Run a script with the profiling and timings requested by its options."""
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"{args.profile}.pstats")
+            write_folded(f"{args.profile}.folded")
+            print(f"Profile written to {args.profile}.pstats and .folded")
+        if args.timings:
+            print_timings(args.timings)
@@ -0,0 +1,18 @@
+"""This module writes the JSON state files of the scripts."""
+
+from __future__ import annotations
+
+import json
+import os
+
+
+def write_json(path: str, content: object) -> None:
+    """Write compact JSON to a file, replacing it atomically.
+
+    The content is written to a temporary sibling first, so that an
+    interrupted run never leaves a truncated file behind.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(content, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
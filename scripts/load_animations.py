@@ -4,24 +4,63 @@ from __future__ import annotations
 
 import os
 import re
+import time
 import warnings
+from dataclasses import dataclass
 from functools import cached_property
-from glob import glob
 from typing import Generator
+from urllib.parse import urlsplit
+
+from animations_cache import AnimationsCache
+from parse_index import IndexMetadata, parse_index
+from scan_animations import (
+    AnimationInventory,
+    list_animation_folders,
+    scan_animation,
+    scan_animations,
+)
+
+
+@dataclass
+class Issue:
+    """An issue found while checking an animation folder."""
+
+    animation: str
+    rule: str
+    severity: str
+    file: str | None
+    message: str
+
+    def __str__(self) -> str:
+        """Format the issue as a log line."""
+        return f"Folder '{self.animation}' {self.message}"
 
 
 class Animation:
     """Represents a folder containing animations and font files."""
 
-    def __init__(self, path: str) -> None:
-        """Initialize the Folder with its path."""
+    def __init__(
+        self,
+        path: str,
+        inventory: AnimationInventory | None = None,
+        metadata: IndexMetadata | None = None,
+    ) -> None:
+        """Initialize the Folder with its path and, optionally, its scanned data."""
         self.path = path
+        if inventory is not None:
+            self.inventory = inventory
+        if metadata is not None:
+            self.metadata = metadata
+
+    @cached_property
+    def inventory(self) -> AnimationInventory:
+        """Get the inventory of the files in the folder."""
+        return scan_animation(self.path)
 
     @cached_property
     def has_index(self) -> bool:
         """Check if the folder contains an index.html file."""
-        index_path = os.path.join(self.path, "index.html")
-        return os.path.isfile(index_path)
+        return self.inventory.has_file("index.html")
 
     @property
     def has_js(self) -> bool:
@@ -48,35 +87,25 @@ class Animation:
         """Get the folder name."""
         return os.path.basename(self.path)
 
-    @cached_property
+    @property
     def font_files(self) -> list[str]:
         """Get a list of embedded font files in the folder."""
-        font_extensions = ["*.ttf", "*.otf", "*.woff", "*.woff2"]
-        font_files = []
-        for font_ext in font_extensions:
-            full_path = os.path.join(self.path, "**", font_ext)
-            found_files = glob(full_path, recursive=True)
-            font_files.extend(found_files)
+        return self.inventory.fonts
 
-        return font_files
-
-    @cached_property
+    @property
     def subfolders(self) -> list[str]:
         """Get a list of subfolders in the folder."""
-        full_path = os.path.join(self.path, "*")
-        return [f for f in glob(full_path) if os.path.isdir(f)]
+        return self.inventory.subfolders
 
-    @cached_property
+    @property
     def css_files(self) -> list[str]:
         """Get a list of css files in the folder."""
-        full_path = os.path.join(self.path, "**", "*.css")
-        return glob(full_path, recursive=True)
+        return self.inventory.css
 
-    @cached_property
+    @property
     def js_files(self) -> list[str]:
         """Get a list of js files in the folder."""
-        full_path = os.path.join(self.path, "**", "*.js")
-        return glob(full_path, recursive=True)
+        return self.inventory.js
 
     @cached_property
     def name(self) -> str:
@@ -85,40 +114,31 @@ class Animation:
         return parts[-1]
 
     @cached_property
-    def title(self) -> str | None:
-        """Get the title of the animation in the folder."""
+    def metadata(self) -> IndexMetadata | None:
+        """Get the metadata parsed from the index.html file in the folder."""
         if not self.has_index:
             return None
 
-        index_path = os.path.join(self.path, "index.html")
-        with open(index_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            r_title = re.search(r"<title>(.*?)</title>", content)
-            if r_title is not None:
-                return r_title.group(1).strip()
-        return None
+        return parse_index(os.path.join(self.path, "index.html"))
 
-    @cached_property
+    @property
+    def title(self) -> str | None:
+        """Get the title of the animation in the folder."""
+        if self.metadata is None:
+            return None
+        return self.metadata.title
+
+    @property
     def description(self) -> str | None:
         """Get the description of the animation in the folder."""
-        if not self.has_index:
+        if self.metadata is None:
             return None
-
-        index_path = os.path.join(self.path, "index.html")
-        with open(index_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            r_description = re.search(
-                r'<meta name="description" content="(.*?)"',
-                content,
-            )
-            if r_description is not None:
-                return r_description.group(1).strip()
-        return None
+        return self.metadata.description
 
     @cached_property
     def preview(self) -> str | None:
         """Get the preview image of the animation in the folder."""
-        previews = list(glob(os.path.join(self.path, "*.png")))
+        previews = self.inventory.top_level("png")
 
         if len(previews) == 0:
             warnings.warn(
@@ -127,7 +147,6 @@ class Animation:
             return None
 
         if len(previews) > 1:
-            previews.sort()
             warnings.warn(
                 f"Folder '{self.name}' has multiple preview images. "
                 f"Using the first one: '{previews[0]}'.",
@@ -138,19 +157,17 @@ class Animation:
     @cached_property
     def has_favicon(self) -> bool:
         """Check if the folder contains a favicon.ico file."""
-        favicon_path = os.path.join(self.path, "favicon.ico")
-        return os.path.isfile(favicon_path)
+        return self.inventory.has_file("favicon.ico")
 
-    @cached_property
+    @property
     def uses_favicon(self) -> bool:
-        """Check if the index.html file references favicon.ico."""
-        full_path = os.path.join(self.path, "index.html")
-        with open(full_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            if "favicon.ico" in content:
-                return True
-
-        return False
+        """Check if an icon link of the index.html file references favicon.ico."""
+        if self.metadata is None:
+            return False
+        return any(
+            os.path.basename(urlsplit(href).path) == "favicon.ico"
+            for href in self.metadata.icons
+        )
 
     def _css_font_map(
         self,
@@ -245,94 +262,205 @@ class Animation:
 
         return list(font for font, used in used_fonts.items() if not used)
 
-    def check_issues(self) -> bool:
-        """Check if the folder has any issues with fonts or structure."""
-        issues_found = False
-
-        if not self.has_index:
-            print(f"Folder '{self.name}' is missing index.html file.")
-            issues_found = True
-        else:
-            if not self.validate_title():
-                print(
-                    f"Folder '{self.name}' has invalid title. "
-                    f"Expected: '{self.valid_title_description}', "
-                    f"Found: '{self.title}'",
-                )
-                issues_found = True
-
-            if not self.validate_description():
-                print(
-                    f"Folder '{self.name}' has invalid description. "
-                    f"Expected: '{self.valid_title_description}', "
-                    f"Found: '{self.description}'",
-                )
-                issues_found = True
-
-        if not self.has_css:
-            print(f"Folder '{self.name}' is missing css folder.")
-            issues_found = True
-
-        if not self.has_js:
-            print(f"Folder '{self.name}' is missing js folder.")
-            issues_found = True
+    def _issue(self, rule: str, message: str, file: str | None = None) -> Issue:
+        """Create an issue found in the folder."""
+        return Issue(
+            animation=self.name,
+            rule=rule,
+            severity="error",
+            file=file,
+            message=message,
+        )
 
+    def _check_index(self) -> list[Issue]:
+        """Check that the folder contains an index.html file."""
+        if self.has_index:
+            return []
+        return [self._issue("index", "is missing index.html file.")]
+
+    def _check_title(self) -> list[Issue]:
+        """Check the title in index.html."""
+        if not self.has_index or self.validate_title():
+            return []
+        return [
+            self._issue(
+                "title",
+                "has invalid title. "
+                f"Expected: '{self.valid_title_description}', "
+                f"Found: '{self.title}'",
+                os.path.join(self.path, "index.html"),
+            )
+        ]
+
+    def _check_description(self) -> list[Issue]:
+        """Check the description in index.html."""
+        if not self.has_index or self.validate_description():
+            return []
+        return [
+            self._issue(
+                "description",
+                "has invalid description. "
+                f"Expected: '{self.valid_title_description}', "
+                f"Found: '{self.description}'",
+                os.path.join(self.path, "index.html"),
+            )
+        ]
+
+    def _check_css(self) -> list[Issue]:
+        """Check that the folder contains css files."""
+        if self.has_css:
+            return []
+        return [self._issue("css", "is missing css folder.")]
+
+    def _check_js(self) -> list[Issue]:
+        """Check that the folder contains js files."""
+        if self.has_js:
+            return []
+        return [self._issue("js", "is missing js folder.")]
+
+    def _check_favicon(self) -> list[Issue]:
+        """Check that favicon.ico exists if and only if it is used."""
+        favicon_path = os.path.join(self.path, "favicon.ico")
         if self.has_favicon and not self.uses_favicon:
-            print(f"Folder '{self.name}' has favicon.ico but does not use it.")
-            issues_found = True
-
+            return [
+                self._issue(
+                    "favicon", "has favicon.ico but does not use it.", favicon_path
+                )
+            ]
         if not self.has_favicon and self.uses_favicon:
-            print(f"Folder '{self.name}' uses favicon.ico but it is missing.")
-            issues_found = True
-
-        if not self.preview:
-            print(f"Folder '{self.name}' is missing preview image.")
-            issues_found = True
-
-        if self.has_fonts:
-            unused_fonts, nonexisting_fonts = self.validate_css_fonts()
-            for font in unused_fonts:
-                print(f"Folder '{self.name}' has unused font file: '{font}'")
-                issues_found = True
-            for css_font in nonexisting_fonts:
-                print(
-                    f"Folder '{self.name}' references non-existing font file in css: "
-                    f"'{css_font}'",
+            return [
+                self._issue(
+                    "favicon", "uses favicon.ico but it is missing.", favicon_path
                 )
-                issues_found = True
-
-            js_unused_fonts = self.validate_js_fonts()
-            for font_family in js_unused_fonts:
-                print(
-                    f"Folder '{self.name}' has font '{font_family}' not used in js files.",
+            ]
+        return []
+
+    def _check_preview(self) -> list[Issue]:
+        """Check that the folder contains a preview image."""
+        if self.preview:
+            return []
+        return [self._issue("preview", "is missing preview image.")]
+
+    def _check_css_fonts(self) -> list[Issue]:
+        """Check that font files and css font references match."""
+        if not self.has_fonts:
+            return []
+
+        issues = []
+        unused_fonts, nonexisting_fonts = self.validate_css_fonts()
+        for font in unused_fonts:
+            issues.append(
+                self._issue("css-fonts", f"has unused font file: '{font}'", font)
+            )
+        for css_font in nonexisting_fonts:
+            issues.append(
+                self._issue(
+                    "css-fonts",
+                    f"references non-existing font file in css: '{css_font}'",
+                    css_font,
                 )
-                issues_found = True
+            )
+        return issues
+
+    def _check_js_fonts(self) -> list[Issue]:
+        """Check that every font declared in css is used in the js files."""
+        if not self.has_fonts:
+            return []
+
+        return [
+            self._issue(
+                "js-fonts",
+                f"has font '{font_family}' not used in js files.",
+                self.css_fonts_map[font_family],
+            )
+            for font_family in self.validate_js_fonts()
+        ]
+
+    def _check_subfolders(self) -> list[Issue]:
+        """Check that the folder contains only the expected subfolders."""
+        return [
+            self._issue(
+                "subfolders", f"has unexpected subfolder: '{subfolder}'", subfolder
+            )
+            for subfolder in self.subfolders
+            if os.path.basename(subfolder) not in ["css", "js", "assets"]
+        ]
+
+    def find_issues(self, timings: dict[str, float] | None = None) -> list[Issue]:
+        """Find the issues with fonts or structure of the folder.
+
+        If timings is provided, the time spent running each rule is added
+        to it, keyed by rule name.
+        """
+        rules = {
+            "index": self._check_index,
+            "title": self._check_title,
+            "description": self._check_description,
+            "css": self._check_css,
+            "js": self._check_js,
+            "favicon": self._check_favicon,
+            "preview": self._check_preview,
+            "css-fonts": self._check_css_fonts,
+            "js-fonts": self._check_js_fonts,
+            "subfolders": self._check_subfolders,
+        }
+
+        issues = []
+        for rule, check in rules.items():
+            started = time.perf_counter()
+            issues.extend(check())
+            if timings is not None:
+                elapsed = time.perf_counter() - started
+                timings[rule] = timings.get(rule, 0) + elapsed
+
+        return issues
 
-        if self.has_subfolders:
-            for subfolder in self.subfolders:
-                if os.path.basename(subfolder) not in ["css", "js", "assets"]:
-                    print(
-                        f"Folder '{self.name}' has unexpected subfolder: '{subfolder}'"
-                    )
-                    issues_found = True
+    def check_issues(self) -> bool:
+        """Check if the folder has any issues with fonts or structure."""
+        issues = self.find_issues()
+        for issue in issues:
+            print(issue)
 
-        return issues_found
+        return len(issues) > 0
 
 
 class AnimationsLoader:
     """Class to load folders from the animations folder."""
 
     animations_folder = "animations"
+    cache_file = ".animations-cache.json"
 
     @staticmethod
-    def load_animations() -> Generator[Animation, None, None]:
-        """Load all folders from the animations folder."""
-        full_path = os.path.join(
-            AnimationsLoader.animations_folder,
-            "*",
-        )
-        for folder in sorted(glob(full_path)):
-            yield Animation(folder)
+    def load_animations(
+        cache_path: str | None = None,
+    ) -> Generator[Animation, None, None]:
+        """Load all folders from the animations folder.
+
+        If cache_path is provided, the inventory and metadata of the animations
+        that did not change since the last run are loaded from the cache file,
+        which is updated once all the animations have been loaded.
+        """
+        if cache_path is None:
+            inventories = scan_animations(AnimationsLoader.animations_folder)
+            for folder, inventory in inventories.items():
+                yield Animation(folder, inventory)
+            return
+
+        cache = AnimationsCache(cache_path)
+        folders = list_animation_folders(AnimationsLoader.animations_folder)
+        for folder in folders:
+            cached = cache.get(folder)
+            if cached is not None:
+                yield Animation(folder, *cached)
+                continue
+
+            stats = {}
+            animation = Animation(folder, scan_animation(folder, stats))
+            cache.put(folder, stats, animation.inventory, animation.metadata)
+            yield animation
+
+        cache.prune(folders)
+        cache.save()
 
     @staticmethod
     def count_animations() -> int:
@@ -0,0 +1,29 @@
+"""This module runs the steps of the scripts on several processes."""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import TypeVar
+
+Item = TypeVar("Item")
+Result = TypeVar("Result")
+
+
+def map_jobs(
+    function: Callable[[Item], Result],
+    items: list[Item],
+    jobs: int,
+    initializer: Callable[[], None] | None = None,
+) -> list[Result]:
+    """Apply a function to every item, using a process pool if jobs is more than 1.
+
+    The items are sent to the workers in chunks, about four per worker, and
+    the results are returned in the same order as the items.
+    """
+    if jobs <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    chunksize = max(1, len(items) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as executor:
+        return list(executor.map(function, items, chunksize=chunksize))
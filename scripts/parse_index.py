@@ -0,0 +1,71 @@
+"""This module parses the index.html file of an animation into a metadata record."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+
+
+@dataclass
+class IndexMetadata:
+    """Metadata extracted from the index.html file of an animation."""
+
+    title: str | None = None
+    description: str | None = None
+    scripts: list[str] = field(default_factory=list)
+    stylesheets: list[str] = field(default_factory=list)
+    icons: list[str] = field(default_factory=list)
+
+
+class _IndexParser(HTMLParser):
+    """HTML parser filling an IndexMetadata record."""
+
+    def __init__(self) -> None:
+        """Initialize the parser with an empty record."""
+        super().__init__()
+        self.metadata = IndexMetadata()
+        self._title_parts: list[str] | None = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        """Collect the metadata carried by the tag attributes."""
+        attributes = {key: value or "" for key, value in attrs}
+
+        if tag == "title" and self.metadata.title is None:
+            self._title_parts = []
+        elif tag == "meta" and attributes.get("name") == "description":
+            if self.metadata.description is None:
+                self.metadata.description = attributes.get("content", "").strip()
+        elif tag == "script" and "src" in attributes:
+            self.metadata.scripts.append(attributes["src"])
+        elif tag == "link" and "href" in attributes:
+            rel = attributes.get("rel", "").lower().split()
+            if "stylesheet" in rel:
+                self.metadata.stylesheets.append(attributes["href"])
+            elif any(kind == "icon" or kind.endswith("-icon") for kind in rel):
+                # "icon", "shortcut icon", "apple-touch-icon", ...
+                self.metadata.icons.append(attributes["href"])
+
+    def handle_data(self, data: str) -> None:
+        """Collect the text of the title tag."""
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def handle_endtag(self, tag: str) -> None:
+        """Close the title tag."""
+        if tag == "title" and self._title_parts is not None:
+            self.metadata.title = "".join(self._title_parts).strip()
+            self._title_parts = None
+
+
+def parse_index_content(content: str) -> IndexMetadata:
+    """Parse the content of an index.html file."""
+    parser = _IndexParser()
+    parser.feed(content)
+    parser.close()
+    return parser.metadata
+
+
+def parse_index(index_path: str) -> IndexMetadata:
+    """Read and parse an index.html file in a single pass."""
+    with open(index_path, "r", encoding="utf-8") as f:
+        return parse_index_content(f.read())
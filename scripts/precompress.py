@@ -0,0 +1,145 @@
+"""This module writes precompressed siblings of the website assets."""
+
+from __future__ import annotations
+
+import gzip
+import os
+
+import brotli
+from parallel import map_jobs
+
+COMPRESSIBLE_EXTENSIONS = [
+    ".html",
+    ".css",
+    ".js",
+    ".json",
+    ".svg",
+    ".txt",
+    ".ico",
+    ".ttf",
+    ".otf",
+]
+
+ENCODINGS = {
+    ".br": lambda data: brotli.compress(data, quality=11),
+    ".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+}
+
+HTACCESS = """\
+# Generated by build_website.py: serve the precompressed assets when possible.
+<IfModule mod_rewrite.c>
+  RewriteEngine On
+
+  RewriteCond %{HTTP:Accept-Encoding} br
+  RewriteCond %{REQUEST_FILENAME}.br -f
+  RewriteRule ^(.*)$ $1.br [E=no-gzip:1,L]
+
+  RewriteCond %{HTTP:Accept-Encoding} gzip
+  RewriteCond %{REQUEST_FILENAME}.gz -f
+  RewriteRule ^(.*)$ $1.gz [E=no-gzip:1,L]
+</IfModule>
+
+<IfModule mod_mime.c>
+  AddEncoding br .br
+  AddEncoding gzip .gz
+</IfModule>
+
+<FilesMatch "\\.html\\.(br|gz)$">
+  ForceType text/html
+</FilesMatch>
+<FilesMatch "\\.css\\.(br|gz)$">
+  ForceType text/css
+</FilesMatch>
+<FilesMatch "\\.js\\.(br|gz)$">
+  ForceType text/javascript
+</FilesMatch>
+<FilesMatch "\\.json\\.(br|gz)$">
+  ForceType application/json
+</FilesMatch>
+<FilesMatch "\\.svg\\.(br|gz)$">
+  ForceType image/svg+xml
+</FilesMatch>
+<FilesMatch "\\.txt\\.(br|gz)$">
+  ForceType text/plain
+</FilesMatch>
+<FilesMatch "\\.ico\\.(br|gz)$">
+  ForceType image/x-icon
+</FilesMatch>
+<FilesMatch "\\.ttf\\.(br|gz)$">
+  ForceType font/ttf
+</FilesMatch>
+<FilesMatch "\\.otf\\.(br|gz)$">
+  ForceType font/otf
+</FilesMatch>
+
+<IfModule mod_headers.c>
+  <FilesMatch "\\.(br|gz)$">
+    Header append Vary Accept-Encoding
+  </FilesMatch>
+</IfModule>
+"""
+
+
+def is_compressible(path: str) -> bool:
+    """Check if a file is worth precompressing, based on its extension."""
+    return os.path.splitext(path)[1] in COMPRESSIBLE_EXTENSIONS
+
+
+def remove_siblings(path: str) -> None:
+    """Remove the precompressed siblings of a file, if any."""
+    for extension in ENCODINGS:
+        if os.path.isfile(path + extension):
+            os.remove(path + extension)
+
+
+def compress_file(path: str, min_saving: float) -> list[str]:
+    """Write the precompressed siblings of a file.
+
+    A sibling is written only if it is at least min_saving (as a fraction
+    of the original size) smaller than the file, otherwise any stale one is
+    removed. Return the extensions of the written siblings.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    written = []
+    for extension, compress in ENCODINGS.items():
+        compressed = compress(data)
+        sibling = path + extension
+        if len(compressed) <= len(data) * (1 - min_saving):
+            with open(sibling, "wb") as f:
+                f.write(compressed)
+            written.append(extension)
+        elif os.path.isfile(sibling):
+            os.remove(sibling)
+
+    return written
+
+
+def _compress_task(args: tuple[str, float]) -> list[str]:
+    """Unpack the arguments of compress_file for the process pool."""
+    return compress_file(*args)
+
+
+def compress_files(paths: list[str], min_saving: float, jobs: int) -> list[list[str]]:
+    """Precompress the files, returning the siblings written for each path."""
+    return map_jobs(_compress_task, [(path, min_saving) for path in paths], jobs)
+
+
+def write_htaccess(destination: str) -> None:
+    """Write the server configuration serving the precompressed assets."""
+    with open(os.path.join(destination, ".htaccess"), "w", encoding="utf-8") as f:
+        f.write(HTACCESS)
+
+
+def remove_htaccess(destination: str) -> None:
+    """Remove the server configuration, if it was written by write_htaccess."""
+    path = os.path.join(destination, ".htaccess")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+    except OSError:
+        return
+
+    if content == HTACCESS:
+        os.remove(path)
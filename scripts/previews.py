@@ -0,0 +1,226 @@
+"""This module transcodes the animation preview images."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass, replace
+
+from json_files import write_json
+from parallel import map_jobs
+from PIL import Image
+
+# resize in two steps (integer reduction, then resampling) when shrinking
+# by more than this factor, which is faster and needs less memory
+REDUCING_GAP = 2.0
+
+# extra encoder options: the default AVIF speed is several times slower and
+# its encoder threads keep a lot of memory around; parallelism comes from jobs
+SAVE_OPTIONS = {"AVIF": {"speed": 8, "max_threads": 1}}
+
+
+@dataclass
+class PreviewVariant:
+    """A size and format in which a preview image is encoded."""
+
+    destination: str
+    size: int
+    format: str
+    quality: int
+
+    @property
+    def mime_type(self) -> str:
+        """Get the MIME type of the variant."""
+        return f"image/{self.format.lower()}"
+
+
+@dataclass
+class PreviewTask:
+    """A preview image to be transcoded into one or more variants."""
+
+    title: str
+    source: str
+    source_hash: str
+    variants: list[PreviewVariant]
+
+
+@dataclass
+class PreviewResult:
+    """The outcome of a preview transcoding."""
+
+    task: PreviewTask
+    square: bool = True
+    error: str | None = None
+    cached: bool = False
+
+
+class ThumbnailCache:
+    """Content-addressed cache of transcoded preview images.
+
+    Entries are keyed by the hash of the source image and the encoding
+    parameters, and the least recently used ones are evicted once the
+    cache grows over its maximum size.
+    """
+
+    index_filename = "index.json"
+
+    def __init__(self, path: str, max_size: int) -> None:
+        """Initialize the cache in the path folder, holding up to max_size bytes."""
+        self._path = path
+        self._max_size = max_size
+        self._index: dict[str, dict] = {}
+
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @property
+    def _index_path(self) -> str:
+        """Get the path of the index file."""
+        return os.path.join(self._path, self.index_filename)
+
+    @staticmethod
+    def key(task: PreviewTask, variant: PreviewVariant) -> str:
+        """Get the cache key of a variant of a task."""
+        options = SAVE_OPTIONS.get(variant.format, {})
+        parameters = (
+            f"{task.source_hash}:{variant.size}:{variant.format}:{variant.quality}:"
+            f"{REDUCING_GAP}:{sorted(options.items())}"
+        )
+        return hashlib.sha256(parameters.encode()).hexdigest()
+
+    def _entry_path(self, key: str, image_format: str) -> str:
+        """Get the path of a cache entry."""
+        return os.path.join(self._path, key[:2], f"{key}.{image_format.lower()}")
+
+    def fetch(self, task: PreviewTask) -> tuple[PreviewResult | None, PreviewTask]:
+        """Copy the cached variants of a task to their destination.
+
+        Return the result of the task if every variant was cached, and the
+        task restricted to the variants that still have to be transcoded.
+        """
+        missing = []
+        square = True
+        for variant in task.variants:
+            key = self.key(task, variant)
+            entry = self._index.get(key)
+            if entry is None:
+                missing.append(variant)
+                continue
+
+            try:
+                shutil.copyfile(
+                    self._entry_path(key, variant.format), variant.destination
+                )
+            except OSError:
+                del self._index[key]
+                missing.append(variant)
+                continue
+
+            entry["last_used"] = time.time()
+            square = entry["square"]
+
+        missing_task = replace(task, variants=missing)
+        if missing:
+            return None, missing_task
+        return PreviewResult(task, square=square, cached=True), missing_task
+
+    def store(self, result: PreviewResult) -> None:
+        """Add the variants of a successful task to the cache."""
+        for variant in result.task.variants:
+            key = self.key(result.task, variant)
+            path = self._entry_path(key, variant.format)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(variant.destination, path)
+
+            self._index[key] = {
+                "square": result.square,
+                "size": os.path.getsize(path),
+                "format": variant.format,
+                "last_used": time.time(),
+            }
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits its size."""
+        total_size = sum(entry["size"] for entry in self._index.values())
+        by_last_use = sorted(self._index.items(), key=lambda e: e[1]["last_used"])
+
+        for key, entry in by_last_use:
+            if total_size <= self._max_size:
+                break
+            try:
+                os.remove(self._entry_path(key, entry["format"]))
+            except FileNotFoundError:
+                pass
+            total_size -= entry["size"]
+            del self._index[key]
+
+    def save(self) -> None:
+        """Evict the exceeding entries and write the index to disk."""
+        self.evict()
+        os.makedirs(self._path, exist_ok=True)
+        write_json(self._index_path, self._index)
+
+
+def transcode_preview(task: PreviewTask) -> PreviewResult:
+    """Decode a preview image once and save each of its variants."""
+    try:
+        with Image.open(task.source) as img:
+            # Check if the image is square
+            square = abs(1 - (img.height / img.width)) <= 0.1
+
+            # let formats that support it (e.g. JPEG) decode at a reduced scale
+            largest = max(variant.size for variant in task.variants)
+            img.draft(img.mode, (largest, largest))
+
+            for variant in task.variants:
+                resized = img.resize(
+                    (variant.size, variant.size), reducing_gap=REDUCING_GAP
+                )
+                resized.save(
+                    variant.destination,
+                    variant.format,
+                    quality=variant.quality,
+                    **SAVE_OPTIONS.get(variant.format, {}),
+                )
+    except Exception as e:
+        return PreviewResult(task, error=str(e))
+
+    return PreviewResult(task, square=square)
+
+
+def transcode_previews(
+    tasks: list[PreviewTask],
+    jobs: int,
+    cache: ThumbnailCache | None = None,
+) -> list[PreviewResult]:
+    """Transcode the preview images, returning the results in the same order.
+
+    Variants found in the cache are copied instead of being transcoded.
+    """
+    results: list[PreviewResult | None] = [None] * len(tasks)
+    missing_tasks = list(tasks)
+    if cache is not None:
+        for i, task in enumerate(tasks):
+            results[i], missing_tasks[i] = cache.fetch(task)
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    to_transcode = [missing_tasks[i] for i in missing]
+
+    transcoded = map_jobs(transcode_preview, to_transcode, jobs)
+
+    for i, result in zip(missing, transcoded):
+        if cache is not None and result.error is None:
+            cache.store(result)
+        result.task = tasks[i]
+        results[i] = result
+
+    if cache is not None:
+        cache.save()
+
+    return results
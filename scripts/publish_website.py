@@ -2,15 +2,36 @@
 
 import argparse
 import asyncio
+import contextlib
 import hashlib
+import json
 import logging
+import mmap
 import os
 import shlex
+import stat
+import struct
 import sys
+import tarfile
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
 from glob import glob
 
 import asyncssh
 import asyncssh.sftp
+from block_delta import (
+    REMOTE_HELPER,
+    SIGNATURE,
+    block_size,
+    compute_delta,
+    encode_delta,
+    parse_signatures,
+)
+from build_manifest import FileRecord, file_record
+from deploy_metrics import FAILED, SKIPPED, DeployMetrics
+from instrumentation import add_arguments, instrumented, span
+from json_files import write_json
 
 
 class SSHKeyError(Exception):
@@ -25,26 +46,209 @@ class SFTPStartError(Exception):
     """Raised when the SFTP session cannot be started."""
 
 
+class ReleaseError(Exception):
+    """Raised when a release cannot be created or activated."""
+
+
+TRANSPORTS = ["sftp", "tar"]
+
+# tarfile stream mode and remote tar flag of each compression of the tar stream
+TAR_COMPRESSIONS = {"none": ("", ""), "gzip": ("gz", "-z")}
+if "zst" in tarfile.TarFile.OPEN_METH:
+    TAR_COMPRESSIONS["zstd"] = ("zst", "--zstd")
+
+
+class _ChunkWriter:
+    """Write-only file object handing a tar stream to the event loop in chunks.
+
+    The archive is written by a worker thread. Each write waits for room in a
+    bounded queue read by the event loop, so that only a few chunks are held
+    in memory whatever the size of the files.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_chunks: int = 64) -> None:
+        """Initialize the writer, feeding a queue read on the given loop."""
+        self._loop = loop
+        self._aborted = False
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(max_chunks)
+
+    def _put(self, data: bytes | None) -> None:
+        """Queue a chunk from the worker thread, waiting for room in the queue."""
+        asyncio.run_coroutine_threadsafe(self.queue.put(data), self._loop).result()
+
+    def write(self, data: bytes) -> int:
+        """Queue data, failing if the stream is no longer read."""
+        if self._aborted:
+            raise BrokenPipeError("The tar stream is no longer read")
+        self._put(data)
+        return len(data)
+
+    def finish(self) -> None:
+        """Mark the end of the stream."""
+        if not self._aborted:
+            self._put(None)
+
+    def abort(self) -> None:
+        """Stop reading the stream, unblocking a write waiting for room."""
+        self._aborted = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+def _reset_owner(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    """Drop the local owner of a tar member, the remote user owns the files."""
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
+
+
+@dataclass
+class SFTPSession:
+    """An SFTP session of the publisher pool, with its usage statistics."""
+
+    sftp: asyncssh.SFTPClient
+    connection: int
+    active: int = 0
+    files: int = 0
+    bytes: int = 0
+    busy_time: float = 0.0
+    busy_since: float = 0.0
+
+
+def _timed_file_record(
+    path: str, previous: FileRecord | None
+) -> tuple[FileRecord, float]:
+    """Get the record of a file along with the time spent getting it."""
+    started = time.perf_counter()
+    record = file_record(path, previous)
+    return record, time.perf_counter() - started
+
+
+def manifest_checksum(files: dict[str, str]) -> str:
+    """Get the checksum of the file hashes recorded in a deployed-state manifest."""
+    content = json.dumps(files, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
 class WebsitePublisher:
-    """Class to publish the website."""
+    """Class to publish the website.
+
+    Along with the website, a manifest of the deployed files and their hash
+    is uploaded. The next publication downloads it instead of hashing every
+    remote file, so that only the differences are uploaded and deleted.
+
+    In release mode, the destination is a symlink to the current release.
+    Each publication uploads into a new release folder, created on the server
+    as a hardlink copy of the current one, and then swaps the symlink.
+
+    Changed files above the delta threshold are sent as block deltas against
+    their remote copy, rebuilt on the server by a Python helper.
+    """
+
+    manifest_file = ".deploy-manifest.json"
+    manifest_version = 1
+    hash_cache_file = ".publish-hash-cache.json"
+    # Each delta runs in its own channel, and servers limit the channels of a
+    # connection (MaxSessions is 10 by default with OpenSSH)
+    delta_concurrency = 4
 
     _source: str
     _destination: str
     _workers: int
+    _verify: bool
+    _transport: str
+    _compression: str
+    _dry_run: bool
+    _site: str
+    _releases_dir: str | None
+    _release: str | None
+    _delta_threshold: int | None
+
+    _connection_count: int
+    _session_count: int
 
     _semaphore: asyncio.Semaphore
     _client: asyncssh.SSHClientConnection
     _sftp: asyncssh.SFTPClient
+    _connections: list[asyncssh.SSHClientConnection]
+    _sessions: list[SFTPSession]
+    _remote_hashes: dict[str, str] | None
+    _local_hashes: dict[str, str]
+    _deployed: dict[str, str] | None
+    _known_dirs: set[str]
+    _created_dirs: set[str]
+    _dir_tasks: dict[str, asyncio.Task]
+    _delta_semaphore: asyncio.Semaphore
+
+    metrics: DeployMetrics
+
+    def __init__(
+        self,
+        source: str,
+        destination: str,
+        workers: int = 10,
+        verify: bool = False,
+        transport: str = "sftp",
+        compression: str = "none",
+        connections: int = 1,
+        sessions: int = 1,
+        releases_dir: str | None = None,
+        dry_run: bool = False,
+        delta_threshold: int | None = None,
+    ) -> None:
+        """Initialize the WebsitePublisher.
+
+        With verify, the deployed-state manifest is ignored and every remote
+        file is hashed to find the differences. With the tar transport, the
+        files are sent as a single tar stream, compressed according to
+        compression, instead of one SFTP upload each.
+
+        The uploads are spread over a pool of SFTP sessions, themselves spread
+        over one or more SSH connections (no more than the sessions).
+
+        With releases_dir, the releases are stored in that remote folder and
+        the destination is the symlink to the current one.
+
+        With dry_run, the changes are only logged, nothing is written on the
+        server.
 
-    def __init__(self, source: str, destination: str, workers: int = 10) -> None:
-        """Initialize the WebsitePublisher."""
+        With delta_threshold, the changed files of at least that many bytes
+        are sent as block deltas, which requires python3 on the server.
+        """
         self._source = source
         self._destination = destination
+        self._site = os.path.normpath(destination)
+        self._releases_dir = releases_dir and os.path.normpath(releases_dir)
+        self._release = None
         self._workers = workers
+        self._verify = verify
+        self._transport = transport
+        self._compression = compression
+        self._dry_run = dry_run
+        self._delta_threshold = delta_threshold
+        self._session_count = max(1, sessions)
+        self._connection_count = max(1, min(connections, self._session_count))
 
         self._semaphore = asyncio.Semaphore(workers)
+        self._remote_hashes = None
+        self._local_hashes = {}
+        self._deployed = None
+        self._known_dirs = set()
+        self._created_dirs = set()
+        self._dir_tasks = {}
+        self._delta_semaphore = asyncio.Semaphore(self.delta_concurrency)
+        self.metrics = DeployMetrics()
+        self._connections = []
+        self._sessions = []
 
-    async def connect(self, host: str, user: str, key: str, password: str) -> None:
+    @property
+    def _failed(self) -> bool:
+        """Check if any operation of the publication failed."""
+        return self.metrics.failures > 0
+
+    async def connect(
+        self, host: str, user: str, key: str, password: str, port: int = 22
+    ) -> None:
         """Connect to the SSH server."""
         logging.info(f"Connecting to %s as %s", host, user)
 
@@ -59,148 +263,630 @@ class WebsitePublisher:
         logging.info("SSH key loaded successfully")
 
         try:
-            self._client = await asyncssh.connect(
-                host=host,
-                username=user,
-                client_keys=[pkey],
-                known_hosts=None,
+            self._connections = list(
+                await asyncio.gather(
+                    *(
+                        asyncssh.connect(
+                            host=host,
+                            port=port,
+                            username=user,
+                            client_keys=[pkey],
+                            known_hosts=None,
+                        )
+                        for _ in range(self._connection_count)
+                    )
+                )
             )
         except Exception as e:
             logging.error(f"Failed to connect to {host}: {e}")
             raise SSHConnectError(str(e)) from e
-        logging.info("Connected to SSH server successfully")
+        self._client = self._connections[0]
+        logging.info(
+            "Connected to SSH server successfully (%d connections)",
+            len(self._connections),
+        )
 
+        # Spread the sessions round-robin over the connections
+        session_connections = [
+            i % len(self._connections) for i in range(self._session_count)
+        ]
         try:
-            self._sftp = await self._client.start_sftp_client()
+            clients = await asyncio.gather(
+                *(
+                    self._connections[connection].start_sftp_client()
+                    for connection in session_connections
+                )
+            )
         except Exception as e:
             logging.error(f"Failed to open SFTP session: {e}")
-            self._client.close()
+            for connection in self._connections:
+                connection.close()
             raise SFTPStartError(str(e)) from e
-        logging.info("SFTP session opened successfully")
+
+        self._sessions = [
+            SFTPSession(sftp, connection)
+            for sftp, connection in zip(clients, session_connections)
+        ]
+        self._sftp = self._sessions[0].sftp
+        logging.info(
+            "SFTP sessions opened successfully (%d sessions)", len(self._sessions)
+        )
 
     async def publish(self) -> None:
         """Publish the website to the server."""
         logging.info("Starting website publication to %s", self._destination)
 
-        await self._ensure_remote_dir(self._destination)
+        self._local_hashes = await self._hash_local_tree()
+
+        if not self._dry_run:
+            await self._ensure_remote_dir(self._destination)
+        if not self._verify:
+            self._deployed = await self._read_deploy_manifest()
+
+        if self._deployed is not None:
+            self._remote_hashes = {
+                self._remote_path(rel_path): sha
+                for rel_path, sha in self._deployed.items()
+            }
+        else:
+            self._remote_hashes = await self._hash_remote_tree(self._destination)
+
+        # The folders of the remote files are known to exist
+        for remote_path in self._remote_hashes or {}:
+            folder = os.path.dirname(remote_path)
+            while folder not in self._known_dirs and folder not in ("", "/"):
+                self._known_dirs.add(folder)
+                folder = os.path.dirname(folder)
+
+        to_upload = [
+            rel_path
+            for rel_path, sha in self._local_hashes.items()
+            if self._remote_hashes is None
+            or self._remote_hashes.get(self._remote_path(rel_path)) != sha
+        ]
+        logging.info(
+            "%d files to upload, %d up to date",
+            len(to_upload),
+            len(self._local_hashes) - len(to_upload),
+        )
+        for rel_path in self._local_hashes.keys() - set(to_upload):
+            size = os.path.getsize(os.path.join(self._source, rel_path))
+            self.metrics.record("upload", self._remote_path(rel_path), SKIPPED, size)
+
+        if self._deployed is not None and not to_upload and not self._stale_files():
+            logging.info("Remote is up to date, nothing to publish")
+            return
+
+        if self._dry_run:
+            for rel_path in to_upload:
+                logging.info("Would upload %s", self._remote_path(rel_path))
+            return
+
+        # An interrupted publication must not leave a manifest describing the
+        # previous state behind
+        await self._remove_deploy_manifest()
+
+        # Create every folder before uploading the files into them
+        folders = {
+            self._remote_path(os.path.relpath(local_path, self._source))
+            for local_path in self._local_paths()
+            if os.path.isdir(local_path)
+        }
+        folders.update(
+            os.path.dirname(self._remote_path(rel_path)) for rel_path in to_upload
+        )
+
+        if self._transport == "tar":
+            # The files sent as deltas are left out of the tar stream
+            streamed = [
+                rel_path for rel_path in to_upload if not self._use_delta(rel_path)
+            ]
+            if await self._upload_tar(streamed, folders - self._known_dirs):
+                to_upload = [
+                    rel_path for rel_path in to_upload if self._use_delta(rel_path)
+                ]
+                folders = set()
+            else:
+                logging.warning("Falling back to SFTP uploads")
+
+        await self._create_remote_dirs(folders)
 
         async def publish_task(local_path: str, remote_path: str) -> None:
             async with self._semaphore:
-                if os.path.isdir(local_path):
-                    await self._ensure_remote_dir(remote_path)
-                else:
-                    await self._ensure_remote_dir(os.path.dirname(remote_path))
-                    await self._upload_file(local_path, remote_path)
-
-        # Walk through the source directory and upload files
-        tasks = []
-        for local_path in glob(f"{self._source}/**", recursive=True):
-            rel_path = os.path.relpath(local_path, self._source)
-            if rel_path == ".":
-                continue
-
-            remote_path = os.path.join(self._destination, rel_path)
-            tasks.append(publish_task(local_path, remote_path))
+                await self._upload_file(local_path, remote_path)
 
-        await asyncio.gather(*tasks)
+        await asyncio.gather(
+            *(
+                publish_task(
+                    os.path.join(self._source, rel_path), self._remote_path(rel_path)
+                )
+                for rel_path in to_upload
+            )
+        )
 
     async def cleanup_remote(self) -> None:
         """Remove remote files that are not in the local source."""
-        if not await self._remote_exists(self._destination):
+        if self._deployed is not None:
+            stale_files = self._stale_files()
+            if not stale_files:
+                return
+        elif not await self._remote_exists(self._destination):
             logging.info(
                 "Remote destination %s does not exist, skipping cleanup",
                 self._destination,
             )
             return
+        else:
+            remote_files = await self._list_remote_files(self._destination)
+            stale_files = [
+                remote_path
+                for remote_path in map(os.path.normpath, remote_files)
+                if remote_path != self._remote_path(self.manifest_file)
+                and not os.path.exists(
+                    os.path.join(
+                        self._source, os.path.relpath(remote_path, self._destination)
+                    )
+                )
+            ]
+
+        if self._dry_run:
+            for remote_path in stale_files:
+                logging.info("Would remove remote file %s", remote_path)
+            return
 
         logging.info("Starting cleanup of remote files not present in local source")
+        if stale_files:
+            await self._remove_remote_files(stale_files)
+
+        await self._remove_empty_remote_dirs(self._destination)
+
+    async def _remove_remote_files(self, remote_paths: list[str]) -> None:
+        """Remove remote files with a single command reading their paths from stdin.
+
+        The files are removed one by one over SFTP if the command fails.
+        """
+        rm_cmd = "xargs -0 -r rm -f --"
+        paths = "".join(f"{path}\0" for path in remote_paths)
+        with self.metrics.measure("remove-batch", self._destination) as operation:
+            try:
+                result = await self._client.run(rm_cmd, input=paths, check=False)
+            except Exception as e:
+                logging.warning(f"Failed to run {rm_cmd}: {e}")
+                result = None
+
+            if result is None or result.exit_status != 0:
+                operation.outcome = "fallback"
 
-        async def cleanup_task(remote_path: str) -> None:
+        if result is not None and result.exit_status == 0:
+            logging.info("Removed %d remote files", len(remote_paths))
+            return
+
+        if result is not None:
+            stderr = result.stderr.strip() if result.stderr else ""
+            logging.warning("Failed to remove the remote files in batch: %s", stderr)
+
+        async def remove_task(remote_path: str) -> None:
             async with self._semaphore:
-                try:
-                    await self._sftp.remove(remote_path)
-                    logging.info("Removed remote file %s", remote_path)
-                except Exception as e:
-                    logging.error(f"Failed to remove remote file {remote_path}: {e}")
+                with self.metrics.measure("remove", remote_path) as operation:
+                    try:
+                        async with self._pool_session() as session:
+                            await session.sftp.remove(remote_path)
+                        logging.info("Removed remote file %s", remote_path)
+                        operation.outcome = "removed"
+                    except asyncssh.sftp.SFTPNoSuchFile:
+                        operation.outcome = SKIPPED
+                    except Exception as e:
+                        logging.error(
+                            f"Failed to remove remote file {remote_path}: {e}"
+                        )
+                        operation.outcome = FAILED
+
+        await asyncio.gather(*(remove_task(path) for path in remote_paths))
 
-        tasks = []
-        for remote_path in await self._list_remote_files(self._destination):
-            local_path = os.path.join(
-                self._source, os.path.relpath(remote_path, self._destination)
+    async def write_deploy_manifest(self) -> None:
+        """Upload the manifest of the deployed files, unless it is up to date.
+
+        The manifest is not written if any upload or removal failed, so that
+        the next publication hashes the remote files again.
+        """
+        if self._dry_run:
+            return
+        if self._failed:
+            logging.warning("Some operations failed, not writing the deploy manifest")
+            return
+        if self._deployed == self._local_hashes:
+            return
+
+        content = {
+            "version": self.manifest_version,
+            "files": self._local_hashes,
+            "checksum": manifest_checksum(self._local_hashes),
+        }
+        remote_path = self._remote_path(self.manifest_file)
+        tmp_path = f"{remote_path}.tmp"
+        data = json.dumps(content, separators=(",", ":")).encode()
+        with self.metrics.measure("manifest", remote_path, len(data)) as operation:
+            try:
+                async with self._sftp.open(tmp_path, "wb") as f:
+                    await f.write(data)
+                await self._sftp.posix_rename(tmp_path, remote_path)
+                operation.outcome = "written"
+            except Exception as e:
+                logging.error(f"Failed to write the deploy manifest {remote_path}: {e}")
+                operation.outcome = FAILED
+                return
+
+        self._deployed = dict(self._local_hashes)
+        logging.info("Wrote the deploy manifest %s", remote_path)
+
+    async def create_release(self) -> str:
+        """Create a new release folder and make it the publication destination.
+
+        The release starts as a hardlink copy of the current one, made on the
+        server, so that only the differences have to be uploaded. Return the
+        release id.
+        """
+        assert self._releases_dir is not None
+        release = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        releases = await self._list_releases()
+        suffix = 1
+        while release in releases:
+            release = f"{release.split('+')[0]}+{suffix}"
+            suffix += 1
+
+        release_path = os.path.join(self._releases_dir, release)
+        current = await self._current_release()
+        if current is not None:
+            source = os.path.join(self._releases_dir, current)
+        elif await self._remote_exists(self._site):
+            # First release over a website published in place
+            source = self._site
+        else:
+            source = None
+
+        if self._dry_run:
+            # Compare against the current release instead
+            logging.info("Would create release %s from %s", release, source)
+            self._release = release
+            self._destination = source or release_path
+            return release
+
+        commands = [f"mkdir -p {shlex.quote(self._releases_dir)}"]
+        if source is not None:
+            commands.append(
+                f"cp -al {shlex.quote(source)} {shlex.quote(release_path)}"
             )
-            if os.path.exists(local_path):
-                continue
-            tasks.append(cleanup_task(remote_path))
-        await asyncio.gather(*tasks)
+        await self._run_release_command(" && ".join(commands), "create the release")
 
-        await self._remove_empty_remote_dirs(self._destination)
+        self._release = release
+        self._destination = release_path
+        logging.info("Created release %s from %s", release, source or "scratch")
+        return release
+
+    async def activate_release(self, release: str | None = None) -> None:
+        """Atomically point the destination symlink to a release.
+
+        Default to the release created by create_release.
+        """
+        assert self._releases_dir is not None
+        release = release or self._release
+        if release is None:
+            raise ReleaseError("No release to activate")
+        if self._failed:
+            raise ReleaseError(f"Some operations failed, not activating {release}")
+        if self._dry_run:
+            logging.info("Would activate release %s", release)
+            return
+
+        site = shlex.quote(self._site)
+        tmp_link = shlex.quote(f"{self._site}.tmp-link")
+        target = os.path.relpath(
+            os.path.join(self._releases_dir, release), os.path.dirname(self._site)
+        )
+        # The symlink is replaced by a rename, so that it always points to a
+        # complete release
+        switch = f"ln -sfn {shlex.quote(target)} {tmp_link} && mv -T {tmp_link} {site}"
+
+        try:
+            attrs = await self._sftp.lstat(self._site)
+            in_place = not stat.S_ISLNK(attrs.permissions or 0)
+        except asyncssh.sftp.SFTPNoSuchFile:
+            in_place = False
+
+        if in_place:
+            # The website was published in place: move it away once
+            old = shlex.quote(f"{self._site}.old")
+            switch = f"rm -rf {old} && mv {site} {old} && {switch} && rm -rf {old}"
+
+        await self._run_release_command(switch, f"activate release {release}")
+        logging.info("Activated release %s", release)
+
+    async def rollback(self, release: str | None = None) -> str:
+        """Activate a previous release, by default the one before the current.
+
+        Return the activated release id.
+        """
+        releases = await self._list_releases()
+        current = await self._current_release()
+
+        if release is None:
+            previous = [r for r in releases if current is None or r < current]
+            if not previous:
+                raise ReleaseError("No previous release to roll back to")
+            release = previous[-1]
+        elif release not in releases:
+            raise ReleaseError(f"Unknown release {release}")
+
+        await self.activate_release(release)
+        return release
+
+    async def prune_releases(self, keep: int) -> list[str]:
+        """Delete the oldest releases, keeping the last keep ones and the current.
+
+        Return the deleted release ids.
+        """
+        assert self._releases_dir is not None
+        releases = await self._list_releases()
+        current = await self._current_release()
+        removed = [r for r in releases[: max(0, len(releases) - keep)] if r != current]
+        if not removed:
+            return []
+        if self._dry_run:
+            logging.info("Would remove old releases %s", ", ".join(removed))
+            return removed
+
+        paths = " ".join(
+            shlex.quote(os.path.join(self._releases_dir, r)) for r in removed
+        )
+        await self._run_release_command(f"rm -rf {paths}", "remove old releases")
+        logging.info("Removed old releases %s", ", ".join(removed))
+        return removed
+
+    async def _list_releases(self) -> list[str]:
+        """List the release ids, oldest first."""
+        assert self._releases_dir is not None
+        try:
+            names = await self._sftp.listdir(self._releases_dir)
+        except asyncssh.sftp.SFTPNoSuchFile:
+            return []
+        return sorted(name for name in names if not name.startswith("."))
+
+    async def _current_release(self) -> str | None:
+        """Get the id of the release the destination symlink points to."""
+        assert self._releases_dir is not None
+        try:
+            site = await self._sftp.realpath(self._site)
+            releases_dir = await self._sftp.realpath(self._releases_dir)
+        except asyncssh.sftp.SFTPError:
+            return None
+
+        if os.path.dirname(site) != releases_dir:
+            return None
+        return os.path.basename(site)
+
+    async def _run_release_command(self, command: str, action: str) -> None:
+        """Run a remote command managing the releases, raising if it fails."""
+        with self.metrics.measure("release", action):
+            try:
+                result = await self._client.run(command, check=False)
+            except Exception as e:
+                raise ReleaseError(f"Failed to {action}: {e}") from e
+
+            if result.exit_status != 0:
+                stderr = result.stderr.strip() if result.stderr else ""
+                raise ReleaseError(f"Failed to {action}: {stderr}")
+
+    async def _read_deploy_manifest(self) -> dict[str, str] | None:
+        """Download the manifest of the deployed files.
+
+        Return None if there is none, or if it is invalid.
+        """
+        remote_path = self._remote_path(self.manifest_file)
+        with self.metrics.measure("manifest", remote_path) as operation:
+            try:
+                async with self._sftp.open(remote_path, "rb") as f:
+                    data = await f.read()
+                operation.outcome = "loaded"
+                operation.size = len(data)
+                content = json.loads(data)
+            except asyncssh.sftp.SFTPNoSuchFile:
+                logging.info("No deploy manifest found, hashing the remote files")
+                operation.outcome = "missing"
+                return None
+            except (asyncssh.sftp.SFTPError, ValueError) as e:
+                logging.warning(
+                    f"Failed to read the deploy manifest {remote_path}: {e}"
+                )
+                operation.outcome = "invalid"
+                return None
+
+        if not isinstance(content, dict) or (
+            content.get("version") != self.manifest_version
+        ):
+            logging.warning("Unsupported deploy manifest, hashing the remote files")
+            return None
+
+        files = content.get("files")
+        if not isinstance(files, dict) or (
+            content.get("checksum") != manifest_checksum(files)
+        ):
+            logging.warning("Corrupted deploy manifest, hashing the remote files")
+            return None
+
+        logging.info("Loaded the deploy manifest of %d files", len(files))
+        return files
+
+    async def _remove_deploy_manifest(self) -> None:
+        """Remove the remote manifest of the deployed files, if any."""
+        try:
+            await self._sftp.remove(self._remote_path(self.manifest_file))
+        except asyncssh.sftp.SFTPNoSuchFile:
+            pass
+
+    def _stale_files(self) -> list[str]:
+        """Get the remote paths of the deployed files removed from the source."""
+        if self._deployed is None:
+            return []
+        return [
+            self._remote_path(rel_path)
+            for rel_path in self._deployed
+            if rel_path not in self._local_hashes
+        ]
+
+    def _remote_path(self, rel_path: str) -> str:
+        """Get the remote path of a file, from its path relative to the source."""
+        return os.path.normpath(os.path.join(self._destination, rel_path))
+
+    def _local_paths(self) -> list[str]:
+        """List the files and folders to publish.
+
+        Hidden files are skipped, except the server configuration written by
+        the builder.
+        """
+        local_paths = glob(f"{self._source}/**", recursive=True)
+        local_paths += glob(f"{self._source}/**/.htaccess", recursive=True)
+        return [
+            local_path
+            for local_path in local_paths
+            if os.path.relpath(local_path, self._source) != "."
+        ]
+
+    async def _hash_local_tree(self) -> dict[str, str]:
+        """Get the SHA256 hash of every file to publish, keyed by relative path.
+
+        The files are hashed in chunks by worker threads, so that the event
+        loop is never blocked. Their records are cached in the source folder,
+        and a file is hashed again only if its modification time or size
+        changed.
+        """
+        cache = self._load_hash_cache()
+        rel_paths = [
+            os.path.relpath(local_path, self._source)
+            for local_path in sorted(self._local_paths())
+            if os.path.isfile(local_path)
+        ]
+        results = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    _timed_file_record,
+                    os.path.join(self._source, rel_path),
+                    cache.get(rel_path),
+                )
+                for rel_path in rel_paths
+            )
+        )
+
+        files = {}
+        for rel_path, (record, duration) in zip(rel_paths, results):
+            previous = cache.get(rel_path)
+            cached = previous is not None and previous[:3] == record
+            outcome = SKIPPED if cached else "hashed"
+            self.metrics.record("hash", rel_path, outcome, int(record[1]), duration)
+            files[rel_path] = record
+        self._save_hash_cache(files)
+        return {rel_path: str(record[2]) for rel_path, record in files.items()}
+
+    def _load_hash_cache(self) -> dict[str, FileRecord]:
+        """Load the records of the files hashed by the previous publication."""
+        try:
+            with open(
+                os.path.join(self._source, self.hash_cache_file), "r", encoding="utf-8"
+            ) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(content, dict) or content.get("version") != 1:
+            return {}
+        return content.get("files", {})
+
+    def _save_hash_cache(self, files: dict[str, FileRecord]) -> None:
+        """Write the records of the hashed files to the source folder."""
+        path = os.path.join(self._source, self.hash_cache_file)
+        try:
+            write_json(path, {"version": 1, "files": files})
+        except OSError as e:
+            logging.warning(f"Failed to write the hash cache {path}: {e}")
 
     async def _remove_empty_remote_dirs(self, remote_path: str) -> None:
         """Remove empty directories left behind under remote_path, deepest first."""
-        find_cmd = f"find {shlex.quote(remote_path)} -mindepth 1 -type d -empty"
-        while True:
+        # With -depth, a directory is tested after its content is removed, so
+        # nested empty directories are all removed in one pass
+        find_cmd = (
+            f"find {shlex.quote(remote_path)} -mindepth 1 -depth -type d -empty"
+            " -print -delete"
+        )
+        with self.metrics.measure("prune-dirs", remote_path) as operation:
             try:
                 result = await self._client.run(find_cmd, check=False)
             except Exception as e:
                 logging.error(
-                    f"Failed to list empty remote directories under {remote_path}: {e}"
+                    "Failed to remove empty remote directories under %s: %s",
+                    remote_path,
+                    e,
                 )
+                operation.outcome = FAILED
                 return
 
-            if result.exit_status != 0 or not result.stdout:
-                return
-
-            empty_dirs = [str(line) for line in result.stdout.splitlines() if line]
-            if not empty_dirs:
+            if result.exit_status != 0:
+                stderr = result.stderr.strip() if result.stderr else ""
+                logging.error(
+                    "Failed to remove empty remote directories under %s: %s",
+                    remote_path,
+                    stderr,
+                )
+                operation.outcome = FAILED
                 return
 
-            # Remove deepest directories first so removing a child can empty its parent.
-            for empty_dir in sorted(
-                empty_dirs, key=lambda p: p.count("/"), reverse=True
-            ):
-                try:
-                    await self._sftp.rmdir(empty_dir)
-                    logging.info("Removed empty remote directory %s", empty_dir)
-                except Exception as e:
-                    logging.error(
-                        f"Failed to remove empty remote directory {empty_dir}: {e}"
-                    )
+        for empty_dir in (result.stdout or "").splitlines():
+            logging.info("Removed empty remote directory %s", empty_dir)
 
     async def _list_remote_files(self, remote_path: str) -> list[str]:
         """List all files in the remote directory."""
         find_cmd = f"find {shlex.quote(remote_path)} -type f"
-        try:
-            result = await self._client.run(find_cmd, check=False)
-        except Exception as e:
-            logging.error(f"Failed to list remote directory {remote_path}: {e}")
-            return []
+        with self.metrics.measure("list", remote_path) as operation:
+            try:
+                result = await self._client.run(find_cmd, check=False)
+            except Exception as e:
+                logging.error(f"Failed to list remote directory {remote_path}: {e}")
+                operation.outcome = FAILED
+                return []
 
         if result.exit_status != 0:
             stderr = result.stderr.strip() if result.stderr else ""
             logging.error("Failed to list remote directory %s: %s", remote_path, stderr)
+            operation.outcome = FAILED
             return []
 
         if result.stdout is None:
             logging.error("No output from remote directory listing for %s", remote_path)
+            operation.outcome = FAILED
             return []
 
         return [str(line) for line in result.stdout.splitlines() if line is not None]
 
-    async def _create_folder(self, remote_path: str) -> None:
-        """Create a folder on the remote server."""
-        if await self._remote_exists(remote_path):
-            return
+    async def _create_folder(self, remote_path: str, check: bool = True) -> bool:
+        """Create a folder on the remote server.
+
+        With check, nothing is done if the folder already exists. Return True
+        if the folder was created.
+        """
+        if check and await self._remote_exists(remote_path):
+            return False
 
         try:
             await self._sftp.mkdir(remote_path)
         except asyncssh.sftp.SFTPFailure:
-            # Another concurrent task may have created it first; ignore if so.
+            # Another publisher may have created it first; ignore if so.
             if not await self._remote_exists(remote_path):
                 raise
+            return False
         except IOError as e:
             logging.error("Failed to create remote folder %s: %s", remote_path, e)
             raise
 
+        return True
+
     async def _remote_exists(self, remote_path: str) -> bool:
         """Check whether a remote path exists."""
         try:
@@ -210,40 +896,307 @@ class WebsitePublisher:
             return False
 
     async def _ensure_remote_dir(self, remote_path: str) -> None:
-        """Create a remote directory and all missing parents."""
+        """Create a remote directory and all missing parents.
+
+        Each directory is checked or created at most once per session, and
+        concurrent calls for the same directory wait for the same operation.
+        """
         if not remote_path:
             return
 
         normalized = os.path.normpath(remote_path)
-        if normalized in (".", "/"):
+        if normalized in (".", "/") or normalized in self._known_dirs:
             return
 
+        task = self._dir_tasks.get(normalized)
+        if task is None:
+            task = asyncio.ensure_future(self._make_remote_dir(normalized))
+            self._dir_tasks[normalized] = task
+        await task
+
+    async def _make_remote_dir(self, normalized: str) -> None:
+        """Create a normalized remote directory after its parents."""
         parent = os.path.dirname(normalized)
         if parent and parent not in (".", normalized):
             await self._ensure_remote_dir(parent)
 
-        if not await self._remote_exists(normalized):
-            await self._create_folder(normalized)
+        # The children of a folder created by this session cannot exist yet
+        with self.metrics.measure("mkdir", normalized) as operation:
+            if await self._create_folder(
+                normalized, check=parent not in self._created_dirs
+            ):
+                self._created_dirs.add(normalized)
+                operation.outcome = "created"
+            else:
+                operation.outcome = "exists"
+        self._known_dirs.add(normalized)
+
+    async def _create_remote_dirs(self, remote_paths: set[str]) -> None:
+        """Create remote directories top-down, those at the same depth concurrently."""
+        by_depth: dict[int, list[str]] = {}
+        for remote_path in remote_paths:
+            normalized = os.path.normpath(remote_path)
+            by_depth.setdefault(normalized.count("/"), []).append(normalized)
+
+        async def create_task(remote_path: str) -> None:
+            async with self._semaphore:
+                await self._ensure_remote_dir(remote_path)
+
+        for depth in sorted(by_depth):
+            await asyncio.gather(*(create_task(path) for path in by_depth[depth]))
+
+    def _use_delta(self, rel_path: str, remote_hash: str | None = None) -> bool:
+        """Check if a file is sent as a delta against its remote copy."""
+        if self._delta_threshold is None:
+            return False
+        remote_path = self._remote_path(rel_path)
+        if remote_hash is None and self._remote_hashes is not None:
+            remote_hash = self._remote_hashes.get(remote_path)
+        if remote_hash is None:
+            return False
+        local_path = os.path.join(self._source, rel_path)
+        return os.path.getsize(local_path) >= self._delta_threshold
 
     async def _upload_file(self, local_path: str, remote_path: str) -> None:
-        local_hash = self._hash_local_file(local_path)
-        remote_hash = await self._hash_remote_file(remote_path)
+        rel_path = os.path.relpath(local_path, self._source)
+        remote_hash = None
+        if self._remote_hashes is None:
+            local_hash = self._local_hashes.get(rel_path)
+            remote_hash = await self._hash_remote_file(remote_path)
+            if remote_hash is not None and local_hash == remote_hash:
+                logging.info("File %s is up to date, skipping upload.", remote_path)
+                size = os.path.getsize(local_path)
+                self.metrics.record("upload", remote_path, SKIPPED, size)
+                return
 
-        if remote_hash is not None and local_hash == remote_hash:
-            logging.info("File %s is up to date, skipping upload.", remote_path)
-            return
+        if self._use_delta(rel_path, remote_hash):
+            if await self._upload_delta(local_path, remote_path):
+                return
 
-        try:
-            await self._sftp.put(local_path, remote_path)
-            logging.info("Uploaded %s to %s", local_path, remote_path)
-        except Exception as e:
-            logging.error(f"Failed to upload {local_path} to {remote_path}: {e}")
+        size = os.path.getsize(local_path)
+        with self.metrics.measure("upload", remote_path, size) as operation:
+            try:
+                async with self._pool_session() as session:
+                    if self._release is None:
+                        await session.sftp.put(local_path, remote_path)
+                    else:
+                        # The file may be hardlinked to the previous releases:
+                        # replace it instead of writing through it
+                        tmp_path = f"{remote_path}.tmp"
+                        await session.sftp.put(local_path, tmp_path)
+                        await session.sftp.posix_rename(tmp_path, remote_path)
+                    session.files += 1
+                    session.bytes += size
+                logging.info("Uploaded %s to %s", local_path, remote_path)
+                operation.outcome = "uploaded"
+            except Exception as e:
+                logging.error(f"Failed to upload {local_path} to {remote_path}: {e}")
+                operation.outcome = FAILED
+
+    async def _upload_delta(self, local_path: str, remote_path: str) -> bool:
+        """Send a file as a block delta against its remote copy.
+
+        The remote helper writes the block signatures of the remote copy, then
+        reads the delta and atomically replaces the remote copy with the
+        rebuilt file. The local file is memory-mapped, so that its blocks are
+        matched and its literal data sent without loading it in memory.
+        Return False if the file has to be uploaded in full.
+        """
+        rel_path = os.path.relpath(local_path, self._source)
+        digest = bytes.fromhex(self._local_hashes[rel_path])
+        with open(local_path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            size = block_size(len(data))
+            delta_cmd = (
+                f"python3 -c {shlex.quote(REMOTE_HELPER)} "
+                f"{shlex.quote(remote_path)} {size}"
+            )
+
+            delta = None
+            signed = False
+            with self.metrics.measure("delta", remote_path) as operation:
+                try:
+                    async with self._delta_semaphore, self._client.create_process(
+                        delta_cmd, encoding=None
+                    ) as process:
+                        try:
+                            header = await process.stdout.readexactly(8)
+                            (remote_size,) = struct.unpack(">Q", header)
+                            count = -(-remote_size // size)
+                            signatures = parse_signatures(
+                                await process.stdout.readexactly(
+                                    count * SIGNATURE.size
+                                )
+                            )
+                            signed = True
+                            delta = await asyncio.to_thread(
+                                compute_delta, data, signatures, size, remote_size
+                            )
+                            if delta is not None:
+                                for instruction in encode_delta(data, delta, digest):
+                                    process.stdin.write(instruction)
+                                    operation.size += len(instruction)
+                                    await process.stdin.drain()
+                            process.stdin.write_eof()
+                        except (asyncio.IncompleteReadError, BrokenPipeError):
+                            pass  # the exit status of the helper tells why
+                        result = await process.wait()
+                except Exception as e:
+                    logging.warning(f"Failed to send the delta of {remote_path}: {e}")
+                    operation.outcome = "fallback"
+                    return False
+
+                if signed and delta is None:
+                    logging.info("Delta of %s too large, uploading it", remote_path)
+                    operation.outcome = "fallback"
+                    return False
+
+                if result.exit_status != 0:
+                    stderr = result.stderr.strip() if result.stderr else b""
+                    logging.warning(
+                        "Failed to apply the delta of %s: %s",
+                        remote_path,
+                        stderr.decode(errors="replace"),
+                    )
+                    if result.exit_status == 127:
+                        # No python3 on the server, do not try again
+                        self._delta_threshold = None
+                    operation.outcome = "fallback"
+                    return False
+
+            logging.info(
+                "Sent %s as a delta of %d bytes instead of %d",
+                remote_path,
+                operation.size,
+                len(data),
+            )
+        self.metrics.record("upload", remote_path, "delta", operation.size)
+        return True
+
+    async def _upload_tar(self, rel_paths: list[str], folders: set[str]) -> bool:
+        """Upload files and folders as a tar stream extracted by a remote tar.
+
+        The archive is generated on the fly from the local files. Return False
+        if the server could not extract it, e.g. because tar is missing.
+        """
+        mode, flag = TAR_COMPRESSIONS[self._compression]
+        tar_cmd = " ".join(
+            filter(None, ["tar", "-x", flag, "-C", shlex.quote(self._destination)])
+        )
+        destination = os.path.normpath(self._destination)
+        writer = _ChunkWriter(asyncio.get_running_loop())
+        durations: dict[str, float] = {}
+
+        def write_tar() -> None:
+            try:
+                # Symlinks (e.g. from --link-mode symlink builds) are sent as
+                # the files they point to, like SFTP uploads and local hashes
+                with tarfile.open(
+                    fileobj=writer, mode=f"w|{mode}", dereference=True
+                ) as tar:
+                    folder_paths = [
+                        os.path.relpath(folder, destination) for folder in folders
+                    ]
+                    for rel_path in sorted(folder_paths) + rel_paths:
+                        if rel_path == "." or rel_path.startswith(".."):
+                            continue
+                        started = time.perf_counter()
+                        local_path = os.path.join(self._source, rel_path)
+                        tar.add(local_path, rel_path, False, filter=_reset_owner)
+                        durations[rel_path] = time.perf_counter() - started
+            finally:
+                writer.finish()
+
+        with self.metrics.measure("tar", self._destination) as operation:
+            try:
+                async with self._client.create_process(
+                    tar_cmd, encoding=None
+                ) as process:
+                    # The archive, compression included, is written by a thread
+                    producer = asyncio.ensure_future(asyncio.to_thread(write_tar))
+                    try:
+                        while (data := await writer.queue.get()) is not None:
+                            operation.size += len(data)
+                            process.stdin.write(data)
+                            await process.stdin.drain()
+                        # A local error ends the upload without closing the
+                        # stream: the members already extracted by the remote
+                        # tar are then overwritten by the SFTP fallback
+                        await producer
+                        process.stdin.write_eof()
+                    except BrokenPipeError:
+                        pass  # the remote tar exited early, its exit status tells why
+                    finally:
+                        writer.abort()
+                        await asyncio.gather(producer, return_exceptions=True)
+                    result = await process.wait()
+            except Exception as e:
+                logging.warning(f"Failed to upload the tar stream: {e}")
+                operation.outcome = "fallback"
+                return False
+
+            if result.exit_status != 0:
+                stderr = result.stderr.strip() if result.stderr else b""
+                logging.warning("Failed to extract the tar stream: %s", stderr.decode())
+                operation.outcome = "fallback"
+                return False
+
+        for rel_path in rel_paths:
+            size = os.path.getsize(os.path.join(self._source, rel_path))
+            remote_path = self._remote_path(rel_path)
+            duration = durations[rel_path]
+            self.metrics.record("upload", remote_path, "uploaded", size, duration)
+
+        logging.info("Uploaded %d files in a tar stream", len(rel_paths))
+        return True
+
+    async def _hash_remote_tree(self, remote_path: str) -> dict[str, str] | None:
+        """Get the SHA256 hash of every file under a remote directory.
+
+        The hashes are computed by a single remote command and parsed as they
+        are streamed back. Return None if the command fails, in which case the
+        files are hashed one by one.
+        """
+        hash_cmd = (
+            f"find {shlex.quote(remote_path)} -type f -print0"
+            " | xargs -0 -r sha256sum"
+        )
+        hashes = {}
+        with self.metrics.measure("hash-remote", remote_path) as operation:
+            try:
+                async with self._client.create_process(hash_cmd) as process:
+                    process.stdin.write_eof()
+                    async for line in process.stdout:
+                        # Names with special characters are escaped by sha256sum
+                        # and flagged by a leading backslash; they are uploaded
+                        # again.
+                        remote_hash, sep, path = line.rstrip("\n").partition("  ")
+                        if sep and not remote_hash.startswith("\\"):
+                            hashes[os.path.normpath(path)] = remote_hash
+                    await process.wait()
+            except Exception as e:
+                logging.warning(f"Failed to hash remote directory {remote_path}: {e}")
+                operation.outcome = "fallback"
+                return None
+
+            if process.exit_status != 0:
+                logging.warning(
+                    "Failed to hash remote directory %s, hashing files one by one",
+                    remote_path,
+                )
+                operation.outcome = "fallback"
+                return None
+
+        logging.info("Hashed %d remote files in %s", len(hashes), remote_path)
+        return hashes
 
     async def _hash_remote_file(self, remote_path: str) -> str | None:
         """Get the SHA256 hash of a remote file."""
         hash_cmd = f"sha256sum {shlex.quote(remote_path)}"
         try:
-            result = await self._client.run(hash_cmd, check=False)
+            with self.metrics.measure("hash-remote", remote_path):
+                result = await self._client.run(hash_cmd, check=False)
         except Exception:
             return None
 
@@ -255,20 +1208,47 @@ class WebsitePublisher:
             return None
         return str(output.split()[0])
 
-    def _hash_local_file(self, local_path: str) -> str:
-        """Get the SHA256 hash of a local file."""
-        with open(local_path, "rb") as f:
-            file_data = f.read()
-            return hashlib.sha256(file_data).hexdigest()
+    @contextlib.asynccontextmanager
+    async def _pool_session(self) -> AsyncIterator[SFTPSession]:
+        """Borrow the least busy SFTP session of the pool."""
+        session = min(self._sessions, key=lambda s: s.active)
+        if session.active == 0:
+            session.busy_since = time.monotonic()
+        session.active += 1
+        try:
+            yield session
+        finally:
+            session.active -= 1
+            if session.active == 0:
+                session.busy_time += time.monotonic() - session.busy_since
+
+    def log_session_stats(self) -> None:
+        """Log the uploads and throughput of each SFTP session of the pool."""
+        for i, session in enumerate(self._sessions):
+            if session.files == 0:
+                continue
+            throughput = session.bytes / session.busy_time if session.busy_time else 0
+            logging.info(
+                "SFTP session %d (connection %d): %d files, %.1f kB in %.2fs, "
+                "%.1f kB/s",
+                i,
+                session.connection,
+                session.files,
+                session.bytes / 1024,
+                session.busy_time,
+                throughput / 1024,
+            )
 
     async def disconnect(self) -> None:
         """Disconnect from the SSH server."""
-        if self._sftp:
-            self._sftp.exit()
-            logging.info("SFTP session closed")
-        if self._client:
-            self._client.close()
-            await self._client.wait_closed()
+        for session in self._sessions:
+            session.sftp.exit()
+        if self._sessions:
+            logging.info("SFTP sessions closed")
+        for connection in self._connections:
+            connection.close()
+            await connection.wait_closed()
+        if self._connections:
             logging.info("SSH client closed")
 
 
@@ -282,6 +1262,12 @@ def gather_args() -> argparse.Namespace:
         type=str,
         help="SSH host for deployment",
     )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=22,
+        help="SSH port for deployment",
+    )
     parser.add_argument(
         "--user",
         type=str,
@@ -313,30 +1299,149 @@ def gather_args() -> argparse.Namespace:
         default=8,
         help="Number of concurrent workers for uploading files",
     )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=4,
+        help="Number of SFTP sessions the uploads are spread over",
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=1,
+        help="Number of SSH connections the SFTP sessions are spread over",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=TRANSPORTS,
+        default="sftp",
+        help="Upload the files one by one over SFTP, or as a single tar stream",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=list(TAR_COMPRESSIONS),
+        default="none",
+        help="Compression of the tar stream",
+    )
+    parser.add_argument(
+        "--releases-dir",
+        type=str,
+        help="Publish atomic releases into this remote folder, the destination "
+        "becoming a symlink to the current release",
+    )
+    parser.add_argument(
+        "--keep-releases",
+        type=int,
+        default=5,
+        help="Number of releases to keep in the releases folder",
+    )
+    parser.add_argument(
+        "--rollback",
+        nargs="?",
+        const="",
+        metavar="RELEASE",
+        help="Activate a previous release (by default the one before the "
+        "current) instead of publishing",
+    )
+    parser.add_argument(
+        "--delta-threshold",
+        type=int,
+        default=0,
+        help="Send the changed files of at least this many bytes as block "
+        "deltas against their remote copy, which requires python3 on the "
+        "server (0, the default, to disable)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the files that would be uploaded and deleted, without "
+        "changing anything on the server",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help="Path of a JSON file to write the publication metrics to",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Hash every remote file instead of trusting the deploy manifest",
+    )
+    add_arguments(parser)
 
     return parser.parse_args()
 
 
+async def run(publisher: WebsitePublisher, args: argparse.Namespace) -> None:
+    """Connect to the server and publish the website, or roll it back."""
+    with span("connect"):
+        await publisher.connect(
+            host=args.host,
+            port=args.port,
+            user=args.user,
+            key=args.ssh_key,
+            password=args.ssh_pwd,
+        )
+
+    if args.rollback is not None:
+        with span("rollback"):
+            await publisher.rollback(args.rollback or None)
+        await publisher.disconnect()
+        return
+
+    try:
+        if args.releases_dir:
+            with span("create-release"):
+                await publisher.create_release()
+
+        with span("publish"):
+            await publisher.publish()
+        with span("cleanup"):
+            await publisher.cleanup_remote()
+        with span("write-manifest"):
+            await publisher.write_deploy_manifest()
+
+        if args.releases_dir:
+            with span("activate-release"):
+                await publisher.activate_release()
+                await publisher.prune_releases(max(1, args.keep_releases))
+    finally:
+        publisher.log_session_stats()
+        publisher.metrics.log_summary()
+        if args.metrics_file is not None:
+            publisher.metrics.write_json(args.metrics_file)
+            logging.info("Metrics written to %s", args.metrics_file)
+
+    await publisher.disconnect()
+
+    if publisher.metrics.failures:
+        raise SystemExit(f"{publisher.metrics.failures} operations failed")
+
+
 async def main() -> None:
     """Script entry point."""
     logging.basicConfig(level=logging.INFO)
     args = gather_args()
+    if args.rollback is not None and not args.releases_dir:
+        raise SystemExit("--rollback requires --releases-dir")
+
     publisher = WebsitePublisher(
         source=args.source,
         destination=args.destination,
         workers=args.workers,
-    )
-    
-    await publisher.connect(
-        host=args.host,
-        user=args.user,
-        key=args.ssh_key,
-        password=args.ssh_pwd,
+        verify=args.verify,
+        transport=args.transport,
+        compression=args.compression,
+        connections=args.connections,
+        sessions=args.sessions,
+        releases_dir=args.releases_dir,
+        dry_run=args.dry_run,
+        delta_threshold=args.delta_threshold or None,
     )
 
-    await publisher.publish()
-    await publisher.cleanup_remote()
-    await publisher.disconnect()
+    with instrumented(args):
+        await run(publisher, args)
 
 
 if __name__ == "__main__":
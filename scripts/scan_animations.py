@@ -0,0 +1,120 @@
+"""This module scans animation folders into an inventory of files."""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+
+FILE_KINDS = {
+    ".js": "js",
+    ".css": "css",
+    ".ttf": "fonts",
+    ".otf": "fonts",
+    ".woff": "fonts",
+    ".woff2": "fonts",
+    ".png": "png",
+    ".ico": "ico",
+    ".html": "html",
+}
+
+
+@dataclass
+class AnimationInventory:
+    """Files found in an animation folder, grouped by kind."""
+
+    path: str
+    js: list[str] = field(default_factory=list)
+    css: list[str] = field(default_factory=list)
+    fonts: list[str] = field(default_factory=list)
+    png: list[str] = field(default_factory=list)
+    ico: list[str] = field(default_factory=list)
+    html: list[str] = field(default_factory=list)
+    subfolders: list[str] = field(default_factory=list)
+
+    def top_level(self, kind: str) -> list[str]:
+        """Get the files of a kind placed directly inside the folder."""
+        return [f for f in getattr(self, kind) if os.path.dirname(f) == self.path]
+
+    def has_file(self, name: str) -> bool:
+        """Check if a file with the given name is placed directly inside the folder."""
+        kind = FILE_KINDS.get(os.path.splitext(name)[1])
+        if kind is None:
+            return False
+        return os.path.join(self.path, name) in getattr(self, kind)
+
+    def sort(self) -> None:
+        """Sort every list of the inventory, making the output deterministic."""
+        for kind in set(FILE_KINDS.values()):
+            getattr(self, kind).sort()
+        self.subfolders.sort()
+
+
+FileStats = dict[str, tuple[int, int]]
+
+
+def _entry_stat(entry: os.DirEntry) -> tuple[int, int]:
+    """Get the modification time (in ns) and size of a directory entry."""
+    stat = entry.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _scan_into(
+    inventory: AnimationInventory,
+    path: str,
+    top_level: bool,
+    stats: FileStats | None,
+) -> None:
+    """Recursively file the entries of path into the inventory."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            # hidden entries are skipped, just like glob does
+            if entry.name.startswith("."):
+                continue
+
+            if entry.is_dir():
+                if top_level:
+                    inventory.subfolders.append(entry.path)
+                if stats is not None:
+                    stats[entry.path] = _entry_stat(entry)
+                _scan_into(inventory, entry.path, False, stats)
+            elif entry.is_file():
+                if stats is not None:
+                    stats[entry.path] = _entry_stat(entry)
+                kind = FILE_KINDS.get(os.path.splitext(entry.name)[1])
+                if kind is not None:
+                    getattr(inventory, kind).append(entry.path)
+
+
+def scan_animation(path: str, stats: FileStats | None = None) -> AnimationInventory:
+    """Scan a single animation folder in one walk.
+
+    If stats is provided, it is filled with the modification time and size
+    of the folder and of every file and subfolder found while scanning.
+    """
+    if stats is not None:
+        stat = os.stat(path)
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+
+    inventory = AnimationInventory(path)
+    _scan_into(inventory, path, True, stats)
+    inventory.sort()
+    return inventory
+
+
+def list_animation_folders(root: str) -> list[str]:
+    """Get the sorted list of animation folders inside root."""
+    with os.scandir(root) as entries:
+        return sorted(
+            entry.path
+            for entry in entries
+            if not entry.name.startswith(".") and entry.is_dir()
+        )
+
+
+def scan_animations(root: str) -> dict[str, AnimationInventory]:
+    """Scan every animation folder inside root in a single pass.
+
+    The returned dictionary maps each folder path to its inventory and is
+    sorted by path.
+    """
+    return {folder: scan_animation(folder) for folder in list_animation_folders(root)}
@@ -0,0 +1,110 @@
+"""This module deduplicates the js and css files shared by several animations."""
+
+from __future__ import annotations
+
+import os
+import re
+
+SHARED_FOLDER = "shared"
+
+SHAREABLE_EXTENSIONS = [".js", ".css"]
+
+# references to other files in html attributes, js imports and css files
+HTML_REFERENCE = re.compile(r"""(\b(?:src|href)\s*=\s*)(["'])([^"']+)\2""")
+JS_REFERENCE = re.compile(r"""(\bfrom\s*|\bimport\s*\(?\s*)(["'])(\.{1,2}/[^"']+)\2""")
+CSS_DEPENDENCY = re.compile(r"url\(|@import", re.IGNORECASE)
+
+
+def is_shareable(path: str) -> bool:
+    """Check if a js or css file can be moved to the shared folder.
+
+    Only files that do not reference other files relative to themselves can
+    be moved without breaking.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension not in SHAREABLE_EXTENSIONS:
+        return False
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+    except (OSError, UnicodeDecodeError):
+        return False
+
+    if extension == ".js":
+        return not JS_REFERENCE.search(content) and "import.meta" not in content
+    return not CSS_DEPENDENCY.search(content)
+
+
+def shared_path(sha: str, extension: str) -> str:
+    """Get the path of a shared asset, relative to the destination."""
+    return f"{SHARED_FOLDER}/{sha[:16]}{extension}"
+
+
+def find_shared_assets(sources: dict[str, dict[str, str]]) -> dict[str, str]:
+    """Find the assets that appear in more than one folder.
+
+    sources maps each folder path to the SHA256 hash of its files, keyed by
+    their path relative to the folder. Return a map from the hash of each
+    shareable asset to its shared path.
+    """
+    locations: dict[tuple[str, str], list[str]] = {}
+    for folder, hashes in sources.items():
+        for rel_path, sha in hashes.items():
+            extension = os.path.splitext(rel_path)[1]
+            if extension in SHAREABLE_EXTENSIONS:
+                path = os.path.join(folder, rel_path)
+                locations.setdefault((sha, extension), []).append(path)
+
+    shared = {}
+    for (sha, extension), paths in sorted(locations.items()):
+        if len(paths) > 1 and is_shareable(paths[0]):
+            shared[sha] = shared_path(sha, extension)
+
+    return shared
+
+
+def _relative_reference(reference: str) -> bool:
+    """Check if a reference points to a file relative to the referencing one."""
+    return not re.match(r"^([a-z][a-z0-9+.-]*:|/|#)", reference, re.IGNORECASE)
+
+
+def rewrite_references(
+    content: str,
+    rel_path: str,
+    folder: str,
+    mapping: dict[str, str],
+) -> str:
+    """Point the references to shared files of an html or js file to the shared copy.
+
+    rel_path is the path of the file relative to its animation folder, and
+    folder is the animation folder relative to the destination. mapping maps
+    the shared files, relative to the animation folder, to their shared path
+    relative to the destination.
+    """
+    extension = os.path.splitext(rel_path)[1]
+    if extension == ".html":
+        pattern = HTML_REFERENCE
+    elif extension == ".js":
+        pattern = JS_REFERENCE
+    else:
+        return content
+
+    base = os.path.dirname(rel_path)
+
+    def replace(match: re.Match) -> str:
+        prefix, quote, reference = match.groups()
+        if not _relative_reference(reference):
+            return match.group(0)
+
+        target = os.path.normpath(os.path.join(base, reference))
+        if target not in mapping:
+            return match.group(0)
+
+        new_reference = os.path.relpath(mapping[target], os.path.join(folder, base))
+        new_reference = new_reference.replace(os.sep, "/")
+        if extension == ".js" and not new_reference.startswith("."):
+            new_reference = f"./{new_reference}"
+        return f"{prefix}{quote}{new_reference}{quote}"
+
+    return pattern.sub(replace, content)
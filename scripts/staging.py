@@ -0,0 +1,63 @@
+"""This module stages the animation files into the destination folder."""
+
+from __future__ import annotations
+
+import os
+import shutil
+
+LINK_MODES = ["copy", "hardlink", "reflink", "symlink"]
+
+# ioctl request cloning a file on copy-on-write filesystems (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def _reflink(source: str, destination: str) -> None:
+    """Clone source into destination, sharing its data blocks."""
+    import fcntl
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
+
+
+def stage_file(source: str, destination: str, link_mode: str = "copy") -> str:
+    """Place source at destination according to link_mode.
+
+    Hardlinks and reflinks fall back to a regular copy when they are not
+    supported, e.g. across filesystems. Any existing destination is
+    unlinked first, so that a file linked by a previous build is never
+    written through. Return the mode that was actually used.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    if link_mode == "hardlink":
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            pass
+    elif link_mode == "reflink":
+        try:
+            _reflink(source, destination)
+            return "reflink"
+        except (OSError, ImportError):
+            if os.path.lexists(destination):
+                os.remove(destination)
+    elif link_mode == "symlink":
+        os.symlink(os.path.abspath(source), destination)
+        return "symlink"
+
+    shutil.copy2(source, destination)
+    return "copy"
+
+
+def write_file(destination: str, content: bytes) -> None:
+    """Write content to destination, unlinking any existing file first."""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    with open(destination, "wb") as f:
+        f.write(content)